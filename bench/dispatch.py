@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Measure the per-element overhead of the parser's handler dispatch for
+elements without a handler (the vast majority in MEDLINE XML), comparing
+the dispatch table to the former chain of tag comparisons and
+``hasattr``/``getattr`` lookups.
+
+usage: bench/dispatch.py [ELEMENTS]
+"""
+import logging
+import struct
+import sys
+import types
+
+from time import time
+from xml.etree.ElementTree import Element
+
+from medic.parser import MedlineXMLParser, logger
+
+# tags of the most frequent elements that have no handler:
+TAGS = ('Year', 'Month', 'Day', 'LastName', 'ForeName', 'Initials', 'Affiliation',
+        'DescriptorName', 'QualifierName', 'AbstractText', 'Author', 'MeshHeading')
+
+
+class ReplayEngine:
+    "An engine that replays a fixed list of (event, element) tuples."
+
+    name = 'replay'
+
+    def __init__(self, events):
+        self.events = events
+
+    def iterparse(self, xml_stream, events, tags):
+        return iter(self.events)
+
+
+class ChainedDispatchParser(MedlineXMLParser):
+    "The parser's former dispatch implementation."
+
+    def parse(self, xml_stream):
+        try:
+            for event, element in self.engine.iterparse(xml_stream, self.events, self.tags):
+                if event == 'start':
+                    self.startElement(element)
+                else:
+                    for instance in self.yieldInstances(element):
+                        yield instance
+        except struct.error:
+            logger.exception('compressed gzip file is corrupt')
+
+    def yieldInstances(self, element):
+        if element.tag == 'PMID':
+            self.PMID(element)
+        elif element.tag == 'DeleteCitation':
+            for pmid in self.DeleteCitation(element):
+                yield pmid
+        elif self.isSkipping():
+            if element.tag == 'MedlineCitation':
+                self.undefined()
+        elif hasattr(self, element.tag):
+            logger.debug('processing %s', element.tag)
+            instance = getattr(self, element.tag)(element)
+
+            if instance is not None:
+                logger.debug('parsed %s', element.tag)
+
+                if isinstance(instance, types.GeneratorType):
+                    for i in instance:
+                        if i is not None:
+                            yield i
+                else:
+                    yield instance
+            else:
+                logger.debug('ignored %s', element.tag)
+
+
+def Benchmark(klass, events: list) -> float:
+    "Return the nanoseconds per element a *klass* parser spends on the *events*."
+    parser = klass(False)
+    parser.engine = ReplayEngine(events)
+    start = time()
+
+    for _ in parser.parse(None):
+        pass
+
+    return (time() - start) * 1e9 / len(events)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    events = [('end', Element(TAGS[i % len(TAGS)])) for i in range(size)]
+
+    for klass in (ChainedDispatchParser, MedlineXMLParser):
+        best = min(Benchmark(klass, events) for _ in range(3))
+        print('{:>22}: {:6.1f} ns/element'.format(klass.__name__, best))
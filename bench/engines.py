@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput of the parsing engines on a (gzipped) MEDLINE XML file.
+
+usage: bench/engines.py FILE [REPEATS]
+"""
+import logging
+import sys
+
+from gzip import open as gunzip
+from time import time
+
+from medic.parser import MedlineXMLParser, ENGINES, ElementTreeEngine, lxml_etree
+
+
+def Benchmark(path: str, engine: str) -> (int, int, float):
+    "Return the number of records, entities, and seconds to parse *path*."
+    parser = MedlineXMLParser(True, engine)
+    records = 0
+    entities = 0
+    stream = gunzip(path, 'rb') if path.lower().endswith('.gz') else open(path, 'rb')
+    start = time()
+
+    try:
+        for instance in parser.parse(stream):
+            entities += 1
+
+            if type(instance) != int and instance.__tablename__ == 'records':
+                records += 1
+    finally:
+        stream.close()
+
+    return records, entities, time() - start
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.strip())
+
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    engines = sorted(ENGINES) if lxml_etree is not None else [ElementTreeEngine.name]
+
+    for name in engines:
+        best = min((Benchmark(sys.argv[1], name) for _ in range(repeats)),
+                   key=lambda result: result[2])
+        print('{:>6}: {:>7} records {:>9} entities {:8.2f} s {:10.1f} records/s'.format(
+            name, best[0], best[1], best[2], best[0] / best[2]
+        ))
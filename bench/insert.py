@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare inserting a (gzipped) MEDLINE XML file into a fresh SQLite DB
+with per-instance session.add calls and with batched Core executemany
+inserts (`medic.crud.insert`).
+
+usage: bench/insert.py FILE [BATCH_SIZE]
+"""
+import logging
+import sys
+
+from datetime import date
+from os.path import join
+from sqlite3 import dbapi2
+from tempfile import TemporaryDirectory
+from time import time
+
+from medic.bulk import BATCH_SIZE
+from medic.crud import insert, _collectCitation, _openFile
+from medic.orm import InitDb, Session, Medline
+from medic.parser import MedlineXMLParser
+
+
+def HandleCitation(handle, instances: list):
+    "Handle the `Medline` instance of a citation first, and then all others."
+    for idx in range(len(instances) - 1, -1, -1):
+        if isinstance(instances[idx], Medline):
+            handle(instances.pop(idx))
+            break
+
+    for i in instances:
+        handle(i)
+
+
+def SessionAdd(session, path: str, _) -> bool:
+    "The previous insert path: add each ORM instance to the session, commit once."
+    def add(instance):
+        if isinstance(instance, Medline):
+            instance.modified = date.today()
+
+        session.add(instance)
+
+    with _openFile(path) as stream:
+        for citation in _collectCitation(MedlineXMLParser(True).parse(stream)):
+            if type(citation) != int:
+                HandleCitation(add, citation)
+
+    session.commit()
+    return True
+
+
+def InsertTime(method, path: str, batch_size: int) -> (int, float):
+    "Return the number of records and seconds to insert *path* into a new DB."
+    with TemporaryDirectory() as tmp:
+        InitDb('sqlite:///' + join(tmp, 'bench.db'), module=dbapi2)
+        session = Session()
+        start = time()
+
+        if not method(session, path, batch_size):
+            sys.exit('inserting {} failed'.format(path))
+
+        seconds = time() - start
+        count = session.query(Medline).count()
+        session.close()
+        return count, seconds
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__.strip())
+
+    batch_size = int(sys.argv[2]) if len(sys.argv) == 3 else BATCH_SIZE
+
+    for name, method in (('session.add', SessionAdd),
+                         ('executemany', lambda s, p, b: insert(s, [p], True, b))):
+        count, seconds = InsertTime(method, sys.argv[1], batch_size)
+        print('{:>12}: {:8.2f} s {:10.1f} records/s'.format(name, seconds, count / seconds))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Compare ORM instances and lightweight rows on the parse-to-dump path:
+the time to parse and dump a (gzipped) MEDLINE XML file and the memory
+per parsed entity.
+
+usage: bench/rows.py FILE
+"""
+import logging
+import sys
+import tracemalloc
+
+from collections import defaultdict
+from gzip import open as gunzip
+from time import time
+
+from medic.crud import _dump
+from medic.parser import MedlineXMLParser
+
+
+class NullStream:
+    "An output stream that discards everything."
+
+    def write(self, data):
+        return len(data)
+
+
+def Open(path: str):
+    return gunzip(path, 'rb') if path.lower().endswith('.gz') else open(path, 'rb')
+
+
+def DumpTime(path: str, rows: bool) -> (int, float):
+    "Return the number of records and seconds to parse and dump *path*."
+    out_stream = defaultdict(NullStream)
+    parser = MedlineXMLParser(True, rows=rows)
+
+    with Open(path) as stream:
+        start = time()
+        count = _dump(stream, out_stream, parser, False)
+        return count, time() - start
+
+
+def EntitySize(path: str, rows: bool) -> (int, float):
+    "Return the number of entities and the bytes each entity uses."
+    parser = MedlineXMLParser(True, rows=rows)
+
+    with Open(path) as stream:
+        tracemalloc.start()
+
+        try:
+            entities = list(parser.parse(stream))
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+    return len(entities), size / len(entities)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    if len(sys.argv) != 2:
+        sys.exit(__doc__.strip())
+
+    for rows in (False, True):
+        count, seconds = min((DumpTime(sys.argv[1], rows) for _ in range(3)),
+                             key=lambda result: result[1])
+        entities, size = EntitySize(sys.argv[1], rows)
+        print('{:>4}: {:8.2f} s {:10.1f} records/s {:8.0f} bytes/entity'.format(
+            'rows' if rows else 'orm', seconds, count / seconds, size
+        ))
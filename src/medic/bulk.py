@@ -0,0 +1,275 @@
+"""
+.. py:module:: medic.bulk
+   :synopsis: Bulk loading parsed citations into the DB.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+"""
+import logging
+
+from datetime import date
+from io import StringIO
+from time import time
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import bindparam, select, text
+
+from medic.orm import Medline, Section, Author, Descriptor, Qualifier, Database, Identifier, \
+        Chemical, Keyword, PublicationType, BULK_KEY_LIMIT
+from medic.rows import Digest
+
+logger = logging.getLogger(__name__)
+
+TABLES = (
+    Medline, Section, Author, Descriptor, Qualifier, Identifier, Database,
+    Chemical, Keyword, PublicationType,
+)
+"""All ORM classes in the order their tables have to be loaded (parents first)."""
+
+BATCH_SIZE = 1000
+"""The default number of citations to buffer before sending them to the DB."""
+
+IN_CHUNK_SIZE = BULK_KEY_LIMIT
+"""The maximum number of PMIDs in a single ``IN`` clause."""
+
+RECORDS = Medline.__tablename__
+
+
+def Loader(session: Session, batch_size: int=BATCH_SIZE, commit_every: int=0):
+    """
+    Create the fastest bulk loader for the *session*'s DB:
+    a `CopyLoader` for PostgreSQL, an `ExecuteManyLoader` otherwise.
+    """
+    if session.connection().dialect.name == 'postgresql':
+        return CopyLoader(session, batch_size, commit_every)
+    else:
+        return ExecuteManyLoader(session, batch_size, commit_every)
+
+
+class BulkLoader:
+    """
+    Buffers the rows of parsed citations by table and sends them to the
+    DB in batches of *batch_size* citations.
+
+    As all rows of a citation are added together and the tables are loaded
+    parents-first, foreign keys are satisfied for each batch. The citation's
+    content hash is set as the `digest` of its record.
+    If *commit_every* is set, the *session* is committed (in chunks) as soon
+    as that many citations were loaded; Otherwise, transactions are left to
+    the owner of the *session*. Subclasses implement `_load`.
+    """
+
+    def __init__(self, session: Session, batch_size: int=BATCH_SIZE, commit_every: int=0):
+        self.session = session
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.replace = False
+        self.buffer = {klass.__tablename__: [] for klass in TABLES}
+        self.pmids = []
+        self.batch = set()
+        self.uncommitted = 0
+        self.committed = 0
+        self.started = time()
+
+    def add(self, citation: list):
+        """
+        Buffer all rows of a *citation* (see `medic.rows`), sending the
+        buffer to the DB once it holds *batch_size* citations.
+
+        When replacing records, a PMID that already is in the buffer first
+        flushes it, so the later citation replaces the earlier one.
+        """
+        if not citation:
+            return
+
+        pmid = citation[0].pmid
+
+        if self.replace and pmid in self.batch:
+            self.flush()
+
+        buffer = self.buffer
+        digest = Digest(citation)
+
+        for instance in citation:
+            buffer[instance.__tablename__].append(instance)
+
+            if instance.__tablename__ == RECORDS:
+                instance.digest = digest
+
+        self.pmids.append(pmid)
+        self.batch.add(pmid)
+        pending = len(self.pmids)
+
+        if pending >= self.batch_size or \
+                (self.commit_every and self.uncommitted + pending >= self.commit_every):
+            self.flush()
+
+    def flush(self):
+        """
+        Send all buffered rows to the DB.
+
+        If `replace` is set, any existing records for the buffered citations
+        are removed first (see `_replace`).
+        """
+        if not self.pmids:
+            return
+
+        if self.replace:
+            self._replace(self.pmids)
+
+        for klass in TABLES:
+            rows = self.buffer[klass.__tablename__]
+
+            if rows:
+                self._load(klass, rows)
+                rows.clear()
+
+        logger.debug('loaded a batch of %i citations', len(self.pmids))
+        self.uncommitted += len(self.pmids)
+        self.pmids = []
+        self.batch.clear()
+
+        if self.commit_every and self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        "Commit the *session*, reporting the loaded citations and time taken."
+        self.session.commit()
+
+        if self.uncommitted:
+            self.committed += self.uncommitted
+            logger.info('committed %i citations in %.1f s (%i in total)',
+                        self.uncommitted, time() - self.started, self.committed)
+            self.uncommitted = 0
+
+        self.session.expunge_all()
+        self.started = time()
+
+    @property
+    def connection(self):
+        "The *session*'s current connection."
+        return self.session.connection()
+
+    def delete(self, pmids: list, tables: iter=(Medline,)):
+        """
+        Delete the rows for the *pmids* from the *tables* (by default, the
+        records and, by cascade, all their entities).
+        """
+        connection = self.connection
+
+        for klass in tables:
+            t = klass.__table__
+
+            for i in range(0, len(pmids), IN_CHUNK_SIZE):
+                connection.execute(t.delete(t.c.pmid.in_(pmids[i:i + IN_CHUNK_SIZE])))
+
+    def _replace(self, pmids: list):
+        "Remove the existing records for the *pmids* before loading them."
+        self.delete(pmids)
+
+    def _load(self, klass, rows: list):
+        raise NotImplementedError('abstract method')
+
+
+class CopyLoader(BulkLoader):
+    """Loads the rows via PostgreSQL's ``COPY ... FROM STDIN`` (using psycopg2)."""
+
+    def __init__(self, *args, **kwargs):
+        super(CopyLoader, self).__init__(*args, **kwargs)
+        self.statements = {
+            klass.__tablename__: 'COPY {} ({}) FROM STDIN'.format(
+                klass.__tablename__, ', '.join(c.name for c in klass.__table__.columns)
+            ) for klass in TABLES
+        }
+
+    def _load(self, klass, rows: list):
+        data = StringIO(''.join(map(str, rows)))
+        cursor = self.connection.connection.cursor()
+
+        try:
+            cursor.copy_expert(self.statements[klass.__tablename__], data)
+        finally:
+            cursor.close()
+
+
+class ExecuteManyLoader(BulkLoader):
+    """Loads the rows with one (DBAPI) ``executemany`` INSERT per table and batch."""
+
+    def _load(self, klass, rows: list):
+        self.connection.execute(klass.__table__.insert(), [r.toDict() for r in rows])
+
+
+class UpsertLoader(ExecuteManyLoader):
+    """
+    Replaces existing citations: deletes the entities of the buffered PMIDs
+    and upserts their records with ``INSERT ... ON CONFLICT (pmid) DO UPDATE``
+    (PostgreSQL 9.5+ and SQLite 3.24+), so the records are updated in place
+    instead of being deleted and re-created.
+
+    Citations with the same `digest` as their stored record are skipped;
+    `skipped` and `rewritten` count the citations for either case. If `touch`
+    is set, the skipped records' `modified` date is still set to today (to
+    mark them as checked).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(UpsertLoader, self).__init__(*args, **kwargs)
+        self.replace = True
+        self.touch = False
+        self.skipped = 0
+        self.rewritten = 0
+        t = Medline.__table__
+        columns = [c.name for c in t.columns if not c.primary_key]
+        self.upsert = text(
+            'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT (pmid) DO UPDATE SET {}'.format(
+                t.name, ', '.join(c.name for c in t.columns),
+                ', '.join(':' + c.key for c in t.columns),
+                ', '.join('{0} = excluded.{0}'.format(name) for name in columns)
+            ), bindparams=[bindparam(c.key, type_=c.type) for c in t.columns]
+        )
+
+    def _replace(self, pmids: list):
+        unchanged = self._unchanged()
+
+        if unchanged:
+            for rows in self.buffer.values():
+                rows[:] = [r for r in rows if r.pmid not in unchanged]
+
+            pmids = [p for p in pmids if p not in unchanged]
+
+            if self.touch:
+                self._touch(list(unchanged))
+
+        self.skipped += len(unchanged)
+        self.rewritten += len(pmids)
+        # children before parents: qualifiers reference descriptors
+        self.delete(pmids, reversed(TABLES[1:]))
+
+    def _touch(self, pmids: list):
+        "Set the `modified` date of the records for the *pmids* to today."
+        t = Medline.__table__
+
+        for i in range(0, len(pmids), IN_CHUNK_SIZE):
+            self.connection.execute(t.update(t.c.pmid.in_(pmids[i:i + IN_CHUNK_SIZE]))
+                                    .values(modified=date.today()))
+
+    def _unchanged(self) -> set:
+        "Return the buffered PMIDs with the same digest as their stored record."
+        digests = {r.pmid: r.digest for r in self.buffer[RECORDS]}
+        pmids = list(digests)
+        t = Medline.__table__
+        unchanged = set()
+
+        for i in range(0, len(pmids), IN_CHUNK_SIZE):
+            query = select([t.c.pmid, t.c.digest], t.c.pmid.in_(pmids[i:i + IN_CHUNK_SIZE]))
+
+            for pmid, digest in self.connection.execute(query):
+                if digest is not None and digest == digests[pmid]:
+                    unchanged.add(pmid)
+
+        return unchanged
+
+    def _load(self, klass, rows: list):
+        if klass is Medline:
+            self.connection.execute(self.upsert, [r.toDict() for r in rows])
+        else:
+            super(UpsertLoader, self)._load(klass, rows)
@@ -5,110 +5,712 @@
 .. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
 .. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
 """
+import json
 import logging
+import re
 
-from functools import partial
-from itertools import chain
+from collections import defaultdict, OrderedDict
+from datetime import date, datetime, timedelta
 from gzip import open as gunzip
-from os import remove
-from os.path import join
+from hashlib import md5
+from multiprocessing import Pool
+from os import mkdir, remove, rmdir, truncate
+from os.path import basename, exists, getsize, join
+from shutil import copyfileobj
+from time import time
 from sqlalchemy.exc import IntegrityError, DatabaseError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, subqueryload, subqueryload_all
 
+from medic.bulk import BATCH_SIZE, BulkLoader, ExecuteManyLoader, Loader, UpsertLoader
 from medic.orm import Medline, Section, Author, Descriptor, Qualifier, Database, Identifier, \
-        Chemical, Keyword, PublicationType
-from medic.parser import MedlineXMLParser, PubMedXMLParser, Parser
-from medic.web import Download
+        Chemical, Keyword, PublicationType, Manifest, PmidFilter, BULK_KEY_LIMIT
+from medic.parser import Engine, MedlineXMLParser, PubMedXMLParser, Parser, Projection
+from medic.pgcopy import HEADER, Concatenate, Encode, Writer
+from medic.pipeline import Pipeline
+from medic.web import CachedDownloadAll
 
 logger = logging.getLogger(__name__)
 
+SYNC_MAX_AGE = 30
+"""The default number of days after which `sync` updates a record."""
 
-def insert(session: Session, files_or_pmids: iter, uniq: bool) -> bool:
-    "Insert all records by parsing the *files* or downloading the *PMIDs*."
-    _add(session, files_or_pmids, lambda i: session.add(i), uniq)
+DUMP_TABLES = (
+    Medline, Section, Descriptor, Qualifier, Author, Identifier, Database,
+    PublicationType, Chemical, Keyword,
+)
+"""The ORM classes of all tables that are dumped."""
 
+DUMP_FORMATS = {
+    'tab': '.tab',
+    'pgbinary': '.bin',
+}
+"""The supported dump formats and their file name extensions."""
 
-def update(session: Session, files_or_pmids: iter, uniq: bool) -> bool:
-    "Update all records in the *files* (paths) or download the *PMIDs*."
-    _add(session, files_or_pmids, lambda i: session.merge(i), uniq)
+DELETE_FILE = "delete.txt"
 
+CHECKPOINT_FILE = "dump.checkpoint"
+"""The file recording the input files a dump has completed (see `dump`)."""
 
-def select(session: Session, pmids: list([int])) -> iter([Medline]):
-    "Return an iterator over all `Medline` records for a list of *PMIDs*."
+SCAN_TAGS = frozenset({'MedlineCitation', 'DeleteCitation'})
+"""The elements to scan for when compacting update files."""
+
+RELATIONS = (
+    'authors', 'chemicals', 'databases', 'descriptors', 'identifiers', 'keywords',
+    'publication_types', 'sections',
+)
+"""The `Medline` relations that `select` can load eagerly."""
+
+
+def insert(session: Session, files_or_pmids: iter, uniq: bool,
+           batch_size: int=BATCH_SIZE, commit_every: int=None, resume: int=0,
+           tables: iter=None) -> bool:
+    """
+    Insert all records by parsing the *files* or downloading the *PMIDs*.
+
+    The records are sent with Core ``executemany`` INSERTs in batches of
+    *batch_size* citations and committed every *commit_every* citations
+    (by default, after each batch). To continue after a failure, *resume*
+    skips that many (committed) citations. If *tables* are given, only the
+    entities of those tables are parsed and inserted (see `Parser`).
+    """
+    loader = ExecuteManyLoader(session, batch_size, commit_every or batch_size)
+    return _add(session, files_or_pmids, loader, uniq, resume, tables)
+
+
+def update(session: Session, files_or_pmids: iter, uniq: bool,
+           batch_size: int=BATCH_SIZE, commit_every: int=None, resume: int=0) -> bool:
+    """
+    Update all records in the *files* (paths) or download the *PMIDs*.
+
+    For each batch of *batch_size* citations, the existing entities are
+    deleted and the records are upserted; Citations that have not changed
+    since they were stored are skipped (see `medic.rows.Digest`).
+    See `insert` for the other parameters.
+    """
+    loader = UpsertLoader(session, batch_size, commit_every or batch_size)
+    result = _add(session, files_or_pmids, loader, uniq, resume)
+    logger.info('skipped %i unchanged and rewrote %i citations',
+                loader.skipped, loader.rewritten)
+    return result
+
+
+def sync(session: Session, pmids: list([int]), uniq: bool, max_age: int=SYNC_MAX_AGE,
+         batch_size: int=BATCH_SIZE, commit_every: int=None) -> bool:
+    """
+    Update the records for a list of *PMIDs* that are missing in the DB or
+    were last modified more than *max_age* days ago.
+
+    Only those PMIDs are downloaded and updated (see `update`), while
+    unchanged citations only get their `Medline.modified` date set to today;
+    The number of PMIDs that did not have to be downloaded and of the
+    unchanged citations that were not rewritten is logged. As synced records
+    are fresh, rerunning a failed sync continues where it stopped.
+    """
+    pmids = [int(p) for p in pmids]
+    before = date.today() - timedelta(days=max_age)
+    missing = Medline.missing(pmids)
+    stale = Medline.modifiedBefore(pmids, before)
+    todo = [p for p in OrderedDict.fromkeys(pmids) if p in missing or p in stale]
+    logger.info('syncing %i of %i PMIDs (%i missing, %i modified before %s)',
+                len(todo), len(pmids), len(missing), len(stale), before)
+
+    loader = UpsertLoader(session, batch_size, commit_every or batch_size)
+    loader.touch = True
+    result = _add(session, todo, loader, uniq) if todo else True
+    logger.info('sync avoided downloading %i PMIDs and rewriting %i unchanged citations',
+                len(pmids) - len(todo), loader.skipped)
+    return result
+
+
+def select(session: Session, pmids: list([int]), eager: iter=(),
+           block_size: int=BULK_KEY_LIMIT, stream: bool=False) -> iter([Medline]):
+    """
+    Return an iterator over all `Medline` records for a list of *PMIDs*.
+
+    By default, the records' relations are loaded lazily, one query per
+    relation and record. If *eager* names any `RELATIONS`, the records are
+    fetched in pages of *block_size* records and those relations are loaded
+    with one query per relation and page instead (``descriptors`` includes
+    their qualifiers).
+
+    If *stream* is ``True``, the records are paged, too, and each record is
+    expunged from the *session* once the consumer requests the next one, so
+    memory use does not depend on the number of records.
+    """
     count = 0
-    for record in session.query(Medline).filter(Medline.pmid.in_(pmids)):
-        count += 1
-        yield record
+
+    with PmidFilter(session.connection(), Medline.pmid, pmids) as clause:
+        if eager or stream:
+            records = _pages(session, clause, [_eagerLoad(name) for name in eager], block_size)
+        else:
+            records = session.query(Medline).filter(clause)
+
+        for record in records:
+            count += 1
+            yield record
+
+            if stream:
+                session.expunge(record)
+
     logger.info("retrieved %i records", count)
 
 
+def _pages(session: Session, clause, options: list, size: int) -> iter([Medline]):
+    """
+    Yield the records matching the *clause* in pages of *size* records,
+    using keyset pagination on the PMID and streaming (server-side) cursors.
+    """
+    last = 0
+
+    while True:
+        query = session.query(Medline).filter(clause & (Medline.pmid > last))
+        query = query.order_by(Medline.pmid).limit(size).execution_options(stream_results=True)
+
+        if options:
+            query = query.options(*options)
+        else:
+            query = query.yield_per(min(size, 100))
+
+        count = 0
+
+        for record in query:
+            count += 1
+            last = record.pmid
+            yield record
+
+        if count < size:
+            break
+
+
+def _eagerLoad(relation: str):
+    "Return the loader option to batch-load a `Medline` *relation*."
+    if relation == 'descriptors':
+        return subqueryload_all(Medline.descriptors, Descriptor.qualifiers)
+    elif relation in RELATIONS:
+        return subqueryload(getattr(Medline, relation))
+    else:
+        raise ValueError('unknown relation "{}"'.format(relation))
+
+
 def delete(session: Session, pmids: list([int])) -> bool:
     "Delete all records for a list of *PMIDs*."
-    count = session.query(Medline).filter(Medline.pmid.in_(pmids)).delete(
-        synchronize_session=False
-    )
+    with PmidFilter(session.connection(), Medline.pmid, pmids) as clause:
+        count = session.query(Medline).filter(clause).delete(synchronize_session=False)
+
     session.commit()
     logger.info("deleted %i records", count)
     return True
 
 
-def dump(files: iter, output_dir: str, unique: bool, update: bool):
+def load(session: Session, files: iter, unique: bool, update: bool,
+         batch_size: int=BATCH_SIZE, tables: iter=None) -> bool:
+    """
+    Bulk-load MEDLINE XML files directly into the DB, bypassing the ORM.
+
+    Each file is loaded in its own transaction, using ``COPY`` on PostgreSQL
+    and batched ``executemany`` inserts otherwise. PMIDs of ``DeleteCitation``
+    elements are deleted after all citations of the file were loaded.
+
+    :param session: the SQL Alchemy DB session
+    :param files: a list of XML files to parse (optionally, gzipped)
+    :param unique: if ``True`` only VersionId == "1" records are loaded
+    :param update: if ``True`` existing records of the parsed citations are
+                   replaced (otherwise, they cause an integrity error)
+    :param batch_size: the number of citations to send to the DB at once
+    :param tables: if given, only the entities of these tables are loaded
+                   (see `Parser`)
+    """
+    parser = MedlineXMLParser(unique, rows=True, tables=tables)
+    total = 0
+
+    for f in files:
+        logger.info('loading %s', f)
+        start = time()
+
+        try:
+            count, deleted = _loadFile(session, f, parser, update, batch_size)
+            session.commit()
+        except IntegrityError:
+            logger.exception('DB integrity violated')
+            session.rollback()
+            return False
+        except DatabaseError:
+            logger.exception('loading %s failed', f)
+            session.rollback()
+            return False
+
+        total += count
+        logger.info('loaded %i citations and deleted %i PMIDs in %.1f s',
+                    count, deleted, time() - start)
+
+    logger.info('loaded %i citations', total)
+    return True
+
+
+def apply(session: Session, files: iter, unique: bool, batch_size: int=BATCH_SIZE) -> bool:
+    """
+    Apply MEDLINE baseline and update files to the DB in sequence, skipping
+    the files already recorded in the `Manifest`.
+
+    The files are applied in the order of their names' sequence numbers
+    (e.g., "medline14n0123.xml.gz"); A file that sorts before the last
+    applied file is an error, and so is an applied file whose checksum has
+    changed since it was applied. Each file is loaded like with `load`
+    (replacing existing records), and its ``DeleteCitation`` PMIDs are
+    deleted, in one transaction that also records the file in the
+    `Manifest`. Therefore, after an error, the same command can be rerun to
+    continue.
+
+    :param session: the SQL Alchemy DB session
+    :param files: a list of XML files to parse (optionally, gzipped)
+    :param unique: if ``True`` only VersionId == "1" records are loaded
+    :param batch_size: the number of citations to send to the DB at once
+    """
+    parser = MedlineXMLParser(unique, rows=True)
+    applied = dict(session.query(Manifest.name, Manifest.checksum))
+    files = sorted(files, key=lambda f: _sequence(basename(f)))
+    todo = [f for f in files if basename(f) not in applied]
+    logger.info('%i of %i files were applied already', len(files) - len(todo), len(files))
+
+    for f in files:
+        if basename(f) in applied and _checksum(f) != applied[basename(f)]:
+            logger.error('%s has changed since it was applied', f)
+            return False
+
+    if todo and applied:
+        last = max(applied, key=_sequence)
+
+        if _sequence(basename(todo[0])) < _sequence(last):
+            logger.error('%s precedes the last applied file %s', basename(todo[0]), last)
+            return False
+
+    for f in todo:
+        logger.info('applying %s', f)
+        start = time()
+
+        try:
+            checksum = _checksum(f)
+            count, deleted = _loadFile(session, f, parser, True, batch_size)
+            session.add(Manifest(basename(f), checksum, count, datetime.now(), time() - start))
+            session.commit()
+        except (DatabaseError, SyntaxError, EOFError, OSError):
+            logger.exception('applying %s failed', f)
+            session.rollback()
+            return False
+
+        logger.info('applied %i citations and deleted %i PMIDs in %.1f s',
+                    count, deleted, time() - start)
+
+    return True
+
+
+def _loadFile(session: Session, name: str, parser: Parser, update: bool,
+              batch_size: int) -> (int, int):
+    """
+    Load the citations in a MEDLINE XML file and delete its ``DeleteCitation``
+    PMIDs, leaving the transaction open.
+
+    :return: the number of citations loaded and of PMIDs deleted
+    """
+    loader = Loader(session, batch_size)
+    loader.replace = update
+    count = 0
+    deletion = []
+
+    with _openFile(name) as stream:
+        for citation in _collectCitation(parser.parse(stream)):
+            if type(citation) == int:
+                deletion.append(citation)
+            else:
+                loader.add(citation)
+                count += 1
+
+    loader.flush()
+
+    if deletion:
+        loader.delete(deletion)
+
+    return count, len(deletion)
+
+
+def _sequence(name: str) -> list:
+    "A key to sort file *name*s by the numbers in them (e.g., 'n2' before 'n10')."
+    return [(int(part), '') if part.isdigit() else (-1, part)
+            for part in re.split(r'(\d+)', name)]
+
+
+def _checksum(name: str) -> str:
+    "Return the MD5 hex digest of a file's content."
+    digest = md5()
+
+    with open(name, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(2 ** 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def dump(files: iter, output_dir: str, unique: bool, update: bool, jobs: int=1,
+         format: str='tab', compact: bool=False, resume: bool=False, tables: iter=None):
     """
     Parse MEDLINE XML files into tabular flat-files for each DB table.
 
     In addtion, a ``delete.txt`` file is generated, containing the PMIDs
     that should first be deleted from the DB before copying the dump.
 
+    Until the dump is complete, the size of every output file after each
+    input file is recorded in a ``dump.checkpoint`` file (one per process),
+    so an interrupted dump can be resumed with the same *files* and *jobs*
+    (see `_dumpFiles`).
+
     :param files: a list of XML files to parse (optionally, gzipped)
     :param output_dir: path to the output directory for the dump
     :param unique: if ``True`` only VersionId == "1" records are dumped
     :param update: if ``True`` the PMIDs of all parsed records are
                    added to the list of PMIDs for deletion
+    :param jobs: the number of worker processes to parse the files with
+    :param format: ``tab`` for PostgreSQL text COPY files (``.tab``) or
+                   ``pgbinary`` for PostgreSQL binary COPY files (``.bin``)
+    :param compact: if ``True`` only the net change of all (update) *files*
+                    is dumped (see `_dumpCompact`; implies *update* and
+                    uses a single process)
+    :param resume: if ``True`` the files completed by an earlier dump to the
+                   *output_dir* are skipped and any partial output is removed
+    :param tables: if given, only these tables are dumped (see `Parser`)
     """
-    out_stream = {
-        Medline.__tablename__: open(join(output_dir, "records.tab"), "wt"),
-        Section.__tablename__: open(join(output_dir, "sections.tab"), "wt"),
-        Descriptor.__tablename__: open(join(output_dir, "descriptors.tab"), "wt"),
-        Qualifier.__tablename__: open(join(output_dir, "qualifiers.tab"), "wt"),
-        Author.__tablename__: open(join(output_dir, "authors.tab"), "wt"),
-        Identifier.__tablename__: open(join(output_dir, "identifiers.tab"), "wt"),
-        Database.__tablename__: open(join(output_dir, "databases.tab"), "wt"),
-        PublicationType.__tablename__: open(join(output_dir, "publication_types.tab"), "wt"),
-        Chemical.__tablename__: open(join(output_dir, "chemicals.tab"), "wt"),
-        Keyword.__tablename__: open(join(output_dir, "keywords.tab"), "wt"),
-        'delete': open(join(output_dir, "delete.txt"), "wt"),
-    }
+    files = list(files)
+
+    if format not in DUMP_FORMATS:
+        raise ValueError('unknown dump format "{}"'.format(format))
+
+    if compact and resume:
+        raise ValueError('a compacted dump cannot be resumed')
+
+    if tables is not None:
+        tables = Projection(tables)
+
+    if compact:
+        count = _dumpCompact(files, output_dir, unique, format, tables)
+    elif jobs > 1 and len(files) > 1:
+        count = _dumpParallel(files, output_dir, unique, update, jobs, format, resume, tables)
+    else:
+        count = _dumpFiles(files, output_dir, unique, update, format, resume, tables)
+        remove(join(output_dir, CHECKPOINT_FILE))
+
+    logger.info("parsed %i records", count)
+
+
+def _dumpFiles(files: list, output_dir: str, unique: bool, update: bool, fmt: str,
+               resume: bool=False, tables: frozenset=None) -> int:
+    """
+    Dump the *files* in order to the output streams in *output_dir*.
+
+    Once a file is dumped, the streams are flushed and the file's name, its
+    number of records, and the size of each stream are appended to the
+    checkpoint; To *resume*, the files in the checkpoint are skipped and the
+    output files are truncated to the sizes recorded for the last of them.
+    """
+    path = join(output_dir, CHECKPOINT_FILE)
+    done = _readCheckpoint(path, files) if resume else []
+    out_stream = _openDump(output_dir, fmt, done[-1]['sizes'] if done else None)
+    encode = Encode if fmt == 'pgbinary' else str
+    count = sum(entry['records'] for entry in done)
+    parser = MedlineXMLParser(unique, rows=True, tables=tables)
+
+    if done:
+        logger.info('resuming after %s (%i of %i files done)',
+                    done[-1]['file'], len(done), len(files))
+
+    try:
+        with open(path, 'wt') as checkpoint:
+            for entry in done:
+                print(json.dumps(entry), file=checkpoint)
+
+            for f in files[len(done):]:
+                logger.info('dumping %s', f)
+
+                with _openFile(f) as in_stream:
+                    records = _dump(in_stream, out_stream, parser, update, encode)
+
+                count += records
+
+                for stream in out_stream.values():
+                    stream.flush()
+
+                entry = {'file': f, 'records': records, 'sizes': {
+                    table: getsize(stream.name) for table, stream in out_stream.items()
+                }}
+                print(json.dumps(entry), file=checkpoint, flush=True)
+    finally:
+        _closeDump(out_stream)
+
+    return count
+
+
+def _readCheckpoint(path: str, files: list) -> list:
+    """
+    Return the entries of the checkpoint at *path* (if it exists), ensuring
+    they match the first of the *files*; A partially written (last) entry is
+    ignored.
+    """
+    entries = []
+
+    if exists(path):
+        with open(path) as stream:
+            for line in stream:
+                if not line.endswith('\n'):
+                    break
+
+                entries.append(json.loads(line))
+
+    names = [entry['file'] for entry in entries]
+
+    if names != files[:len(names)]:
+        raise ValueError('the files do not match the dump checkpoint {}'.format(path))
+
+    return entries
+
+
+def _dumpCompact(files: list, output_dir: str, unique: bool, fmt: str,
+                 tables: frozenset=None) -> int:
+    """
+    Dump the net change of the (update) *files* applied in order: only the
+    last version of each citation is dumped, unless a ``DeleteCitation`` in
+    the same or a later file removes it, and the ``delete.txt`` lists each
+    PMID of the dumped or deleted citations once.
+
+    First, the PMIDs in all files are scanned (see `_scanPmids`) and resolved
+    from the last file to the first; Then, only the files with citations to
+    keep are parsed.
+    """
+    scans = [_scanPmids(f, unique) for f in files]
+    touched = set()
+    keep = []
+
+    for citations, deletions in reversed(scans):
+        # a file's deletions are applied after its citations
+        touched.update(deletions)
+        occurrences = defaultdict(int)
+        indexed = []
+        last = {}
+
+        for pmid in citations:
+            indexed.append((pmid, occurrences[pmid]))
+            occurrences[pmid] += 1
+
+        for pmid, occurrence in reversed(indexed):
+            if pmid not in touched:
+                touched.add(pmid)
+                last[pmid] = occurrence
+
+        keep.append(last)
+
+    keep.reverse()
+    out_stream = _openDump(output_dir, fmt)
+    encode = Encode if fmt == 'pgbinary' else str
+    parser = MedlineXMLParser(unique, rows=True, tables=tables)
     count = 0
-    parser = MedlineXMLParser(unique)
 
-    for f in files:
-        logger.info('dumping %s', f)
+    try:
+        for f, last in zip(files, keep):
+            if not last:
+                logger.info('skipping %s (all citations are superseded)', f)
+                continue
+
+            logger.info('dumping %s', f)
+            seen = defaultdict(int)
+
+            citation = []
+
+            with _openFile(f) as in_stream:
+                for row in parser.parse(in_stream):
+                    if type(row) == int:
+                        continue
 
-        if f.lower().endswith('.gz'):
-            in_stream = gunzip(f, 'rb')
+                    citation.append(row)
+
+                    if row.__tablename__ == Medline.__tablename__:
+                        # the record row is the last row of each citation
+                        if last.get(row.pmid) == seen[row.pmid]:
+                            for i in citation:
+                                out_stream[i.__tablename__].write(encode(i))
+
+                            count += 1
+
+                        seen[row.pmid] += 1
+                        citation.clear()
+
+        for pmid in sorted(touched):
+            print(pmid, file=out_stream['delete'])
+    finally:
+        _closeDump(out_stream)
+
+    logger.info('compacted %i files to %i citations and %i deletions',
+                len(files), count, len(touched) - count)
+    return count
+
+
+def _scanPmids(name: str, unique: bool) -> (list, set):
+    """
+    Return the PMIDs of the citations (in order) and the ``DeleteCitation``
+    PMIDs in a MEDLINE XML file without parsing the citations.
+    """
+    engine = Engine()
+    citations = []
+    deletions = set()
+
+    with _openFile(name) as stream:
+        for event, element in engine.iterparse(stream, ('start', 'end'), SCAN_TAGS):
+            if event != 'end':
+                continue
+            elif element.tag == 'MedlineCitation':
+                version = element.get('VersionID')
+
+                if not unique or version is None or version.strip() == '1':
+                    citations.append(int(element.findtext('PMID')))
+
+                engine.prune(element)
+            elif element.tag == 'DeleteCitation':
+                deletions.update(int(e.text) for e in element.findall('PMID'))
+                engine.prune(element)
+
+    return citations, deletions
+
+
+def _dumpShard(args: tuple) -> int:
+    """
+    Worker process entry point: dump a
+    ``(files, shard_dir, unique, update, fmt, resume, tables)`` shard.
+    """
+    files, shard_dir, unique, update, fmt, resume, tables = args
+
+    if not (resume and exists(shard_dir)):
+        mkdir(shard_dir)
+
+    return _dumpFiles(files, shard_dir, unique, update, fmt, resume, tables)
+
+
+def _dumpParallel(files: list, output_dir: str, unique: bool, update: bool, jobs: int,
+                  fmt: str, resume: bool=False, tables: frozenset=None) -> int:
+    """
+    Dump the *files* using *jobs* worker processes.
+
+    Each worker parses a contiguous slice of the *files* into its own shard
+    directory; concatenating the shards in worker order therefore preserves
+    the order of the (update) files in the merged ``delete.txt``. The shards
+    are only removed once they all are merged, so an interrupted dump can be
+    resumed from them (with the same number of *jobs*).
+    """
+    jobs = min(jobs, len(files))
+    size, rest = divmod(len(files), jobs)
+    shards = []
+    start = 0
+
+    for n in range(jobs):
+        end = start + size + (1 if n < rest else 0)
+        shard_dir = join(output_dir, 'shard{:03d}'.format(n))
+        shards.append((files[start:end], shard_dir, unique, update, fmt, resume, tables))
+        start = end
+
+    logger.info('dumping %i files with %i processes', len(files), jobs)
+
+    with Pool(jobs) as pool:
+        count = sum(pool.map(_dumpShard, shards, chunksize=1))
+
+    _mergeShards([s[1] for s in shards], output_dir, fmt)
+    return count
+
+
+def _mergeShards(shard_dirs: list, output_dir: str, fmt: str):
+    "Concatenate the dump files of all *shard_dirs* (in order) into *output_dir*."
+    for table, name in _dumpFileNames(fmt).items():
+        target = join(output_dir, name)
+        parts = [join(d, name) for d in shard_dirs if exists(join(d, name))]
+
+        if fmt == 'pgbinary' and table != 'delete':
+            Concatenate(parts, target)
         else:
-            in_stream = open(f)
+            with open(target, 'wb') as out:
+                for part in parts:
+                    with open(part, 'rb') as stream:
+                        copyfileobj(stream, out)
 
-        count += _dump(in_stream, out_stream, parser, update)
+        if getsize(target) == 0:
+            remove(target)
 
-    for stream in out_stream.values():
-        if stream.tell() == 0:
-            stream.close()
-            remove(join(output_dir, stream.name))
+    for shard_dir in shard_dirs:
+        for name in list(_dumpFileNames(fmt).values()) + [CHECKPOINT_FILE]:
+            if exists(join(shard_dir, name)):
+                remove(join(shard_dir, name))
+
+        rmdir(shard_dir)
+
+
+def _dumpFileNames(fmt: str) -> dict:
+    "Return the file names of a dump's output streams in a *fmt*, by table name."
+    names = {
+        klass.__tablename__: klass.__tablename__ + DUMP_FORMATS[fmt] for klass in DUMP_TABLES
+    }
+    names['delete'] = DELETE_FILE
+    return names
+
+
+def _openDump(output_dir: str, fmt: str, sizes: dict=None) -> dict:
+    """
+    Open the output streams (by table name) for a dump in *output_dir*.
+
+    If the *sizes* (by table name) of a checkpoint are given, the existing
+    output files are truncated to those sizes and appended to.
+    """
+    out_stream = {}
+
+    for table, name in _dumpFileNames(fmt).items():
+        path = join(output_dir, name)
+        binary = fmt == 'pgbinary' and table != 'delete'
+        append = sizes is not None and _truncate(path, sizes[table], binary)
+
+        if binary:
+            out_stream[table] = Writer(path, append)
         else:
-            stream.close()
+            out_stream[table] = open(path, "at" if append else "wt")
 
-    logger.info("parsed %i records", count)
+    return out_stream
+
+
+def _truncate(path: str, size: int, binary: bool) -> bool:
+    """
+    Truncate the output file at *path* to the *size* it had at a checkpoint
+    and return ``True``, or ``False`` if the (then empty) file was removed.
+    """
+    if exists(path):
+        if getsize(path) < size:
+            raise ValueError('{} is shorter than at the dump checkpoint'.format(path))
+
+        truncate(path, size)
+        return True
+    elif size != (len(HEADER) if binary else 0):
+        raise ValueError('{} is missing, but not empty at the dump checkpoint'.format(path))
+
+    return False
+
+
+def _closeDump(out_stream: dict):
+    "Close all output streams, removing those files that remained empty."
+    for stream in out_stream.values():
+        stream.close()
+
+        if getsize(stream.name) == 0:
+            remove(stream.name)
 
 
-def _dump(in_stream, out_stream: dict, parser: Parser, update: bool) -> int:
+def _dump(in_stream, out_stream: dict, parser: Parser, update: bool, encode=str) -> int:
     count = 0
 
     for i in parser.parse(in_stream):
         if type(i) == int:
             print(i, file=out_stream['delete'])
         else:
-            out_stream[i.__tablename__].write(str(i))
+            out_stream[i.__tablename__].write(encode(i))
 
             if i.__tablename__ == Medline.__tablename__:
                 count += 1
@@ -119,8 +721,21 @@ def _dump(in_stream, out_stream: dict, parser: Parser, update: bool) -> int:
     return count
 
 
-def _add(session: Session, files_or_pmids: iter, dbHandle, unique: bool=True):
+def _add(session: Session, files_or_pmids: iter, loader: BulkLoader, unique: bool=True,
+         resume: int=0, tables: iter=None) -> bool:
+    """
+    Parse the *files* and download the *PMIDs*, sending each citation to
+    the *loader*.
+
+    Each downloaded batch is committed as soon as it is loaded; PMIDs that
+    cannot be downloaded are reported at the end (and make the result
+    ``False``).
+
+    :param resume: the number of (already committed) citations to skip
+    :param tables: if given, only the entities of these tables are parsed
+    """
     pmids = []
+    failed = []
     count = 0
     initial = session.query(Medline).count() if logger.isEnabledFor(logging.INFO) else 0
 
@@ -130,38 +745,54 @@ def _add(session: Session, files_or_pmids: iter, dbHandle, unique: bool=True):
                 pmids.append(int(arg))
             except ValueError:
                 logger.info("parsing %s", arg)
-                count += _streamInstances(session, dbHandle, _fromFile(arg, unique))
+                count += _streamInstances(loader, _fromFile(arg, unique, tables),
+                                          max(0, resume - count))
 
         if len(pmids):
-            count += _downloadAll(session, dbHandle, pmids, unique)
+            for instances in _downloadAll(pmids, unique, failed, tables):
+                count += _streamInstances(loader, instances, max(0, resume - count))
+                # keep each downloaded batch, even if a later download fails
+                loader.flush()
+                loader.commit()
 
-        session.commit()
+        loader.flush()
+        loader.commit()
 
         if logger.isEnabledFor(logging.INFO):
             final = session.query(Medline).count()
-            logger.info('parsed %i entities (records before/after: %i/%i)',
+            logger.info('parsed %i citations (records before/after: %i/%i)',
                         count, initial, final)
+
+        if failed:
+            logger.error('failed to download %i PMIDs: %s',
+                         len(failed), ' '.join(map(str, failed)))
+            return False
+
         return True
     except IntegrityError:
         logger.exception('DB integrity violated')
         session.rollback()
-        return False
     except DatabaseError:
         logger.exception('adding records failed')
-        if session.dirty:
-            session.rollback()
-        return False
+        session.rollback()
+
+    logger.error('%i citations were committed; use --resume %i to continue',
+                 resume + loader.committed, resume + loader.committed)
+    return False
 
 
-def _streamInstances(session: Session, handle, stream: iter) -> int:
+def _streamInstances(loader: BulkLoader, stream: iter, skip: int=0) -> int:
     """
-    Stream citations and delete records in DB.
+    Stream citations to the *loader* and delete records in DB.
 
     If PMIDs (integers) are encountered on the stream, they are deleted after
-    all citations have been handled.
+    all citations have been loaded.
 
-    :param session: the DB session object (SQL Alchemy)
-    :param handle: a DB handle to send ORM instances
+    :param loader: the bulk loader to send the citations to
+    :param stream: the parsed instances
+    :param skip: the number of (already committed) citations to skip; the
+                 deletions are skipped, too, if the stream has less citations
+    :return: the number of citations on the stream
     """
     count = 0
     deletion = []
@@ -170,10 +801,15 @@ def _streamInstances(session: Session, handle, stream: iter) -> int:
         if type(citation) == int:
             deletion.append(citation)
         else:
-            count += _handleCitation(handle, citation)
+            count += 1
 
-    if deletion:
-        delete(session, deletion)
+            if count > skip:
+                loader.add(citation)
+
+    if deletion and count >= skip:
+        loader.flush()
+        loader.delete(deletion)
+        logger.info("deleted %i records", len(deletion))
 
     logging.debug("streamed %i citations", count)
     return count
@@ -203,43 +839,32 @@ def _collectCitation(stream: iter) -> iter:
         yield citation
 
 
-def _handleCitation(handle, instances: list):
-    "Handle a list of instances representing a citation."
-    # handle the Medline object first:
-    for idx in range(len(instances) - 1, -1, -1):
-        if isinstance(instances[idx], Medline):
-            logger.debug('handling PMID %s', instances[idx].pmid)
-            handle(instances.pop(idx))
-            break
-
-    # and everythin else after that:
-    for i in instances:
-        handle(i)
-
-    return 1
-
-
-def _downloadAll(session: Session, dbHandle, pmids: list, unique: bool=True) -> int:
+def _downloadAll(pmids: list, unique: bool=True, failed: list=None,
+                 tables: iter=None) -> Pipeline:
     """
-    Download PubMed XML for a list of PMIDs (integers), parse the streams,
-    and send the ORM instances to a DB handle.
+    Download PubMed XML for a list of PMIDs (integers) and return an
+    iterator over the lists of parsed (`medic.rows`) instances per download.
+
+    The downloads run concurrently (see `medic.web.DownloadAll`), and the
+    streams are parsed (in order) in a `medic.pipeline.Pipeline` stage of
+    their own, so downloading, parsing, and writing to the DB (the consumer)
+    overlap; Records in the `medic.web.CACHE` are not downloaded again
+    (see `medic.web.CachedDownloadAll`).
 
-    :param session: the SQL Alchemy DB session
-    :param dbHandle: a function that takes one instance and sends it to the DB
     :param pmids: the list of PMIDs to download
     :param unique: if ``True``, only VersionID == "1" records are handled.
+    :param failed: a list to collect the PMIDs that cannot be downloaded in;
+                   if ``None``, download errors are raised
+    :param tables: if given, only the instances for these tables are parsed
     """
-    parser = PubMedXMLParser(unique)
-    pmid_sets = [pmids[100 * i:100 * i + 100] for i in range(len(pmids) // 100 + 1)]
-    downloads = map(Download, pmid_sets)
-    instances = map(parser.parse, downloads)
-    streaming = partial(_streamInstances, session, dbHandle)
-    return sum(map(streaming, chain(instances)))
+    parser = PubMedXMLParser(unique, rows=True, tables=tables)
+    parse = lambda stream: list(parser.parse(stream))
+    return Pipeline(CachedDownloadAll(pmids, failed=failed), [('parse', parse)], 'write')
 
 
-def _fromFile(name: str, unique: bool) -> iter:
+def _fromFile(name: str, unique: bool, tables: iter=None) -> iter:
     logger.info("parsing %s", name)
-    parser = MedlineXMLParser(unique)
+    parser = MedlineXMLParser(unique, rows=True, tables=tables)
     stream = _openFile(name)
     return parser.parse(stream)
 
@@ -249,4 +874,4 @@ def _openFile(name):
         # use wrapper to support pre-3.3
         return gunzip(name, 'rb')
     else:
-        return open(name)
+        return open(name, 'rb')
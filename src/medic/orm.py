@@ -7,22 +7,26 @@
 """
 
 import logging
-from datetime import date
+from contextlib import contextmanager
+from itertools import count
+from datetime import date, datetime
 from sqlalchemy import engine, select, and_, Enum
 from sqlalchemy import event
 from sqlalchemy.engine import RowProxy
 from sqlalchemy.engine.url import URL
+from sqlalchemy.exc import DatabaseError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relation, session
 from sqlalchemy.orm.collections import column_mapped_collection
 from sqlalchemy.schema import \
-    Column, CheckConstraint, ForeignKeyConstraint, ForeignKey, Index
+    Column, CheckConstraint, ForeignKeyConstraint, ForeignKey, Index, MetaData, Table
 from sqlalchemy.types import \
-    Boolean, BigInteger, Date, SmallInteger, Unicode, UnicodeText
+    Boolean, BigInteger, Date, DateTime, Float, Integer, SmallInteger, String, Unicode, \
+    UnicodeText
 
 __all__ = [
     'Medline', 'Author', 'Chemical', 'Database', 'Descriptor',
-    'Identifier', 'Keyword', 'Qualifier', 'Section', 'PublicationType'
+    'Identifier', 'Keyword', 'Qualifier', 'Section', 'PublicationType', 'Manifest'
 ]
 
 _Base = declarative_base()
@@ -35,6 +39,24 @@ STRING = lambda s: s.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\
 
 logger = logging.getLogger(__name__)
 
+BULK_KEY_LIMIT = 500
+"""
+The maximum number of PMIDs in an ``IN`` list; Larger PMID lists are
+loaded into a temporary key table (see `PmidFilter`).
+"""
+
+_pmid_keys = count()
+# numbers the temporary key tables, so (nested) PmidFilters never share one
+
+
+def _PmidKeys() -> Table:
+    "Return a new temporary PMID key table with a unique name."
+    return Table(
+        'pmid_keys_{}'.format(next(_pmid_keys)), MetaData(),
+        Column('pmid', BigInteger, primary_key=True, autoincrement=False),
+        prefixes=['TEMPORARY']
+    )
+
 
 def InitDb(*args, **kwds):
     """
@@ -77,6 +99,44 @@ def Session(*args, **kwds) -> session.Session:
     return _session(*args, **kwds)
 
 
+@contextmanager
+def PmidFilter(conn, column, pmids: iter):
+    """
+    Context manager providing a clause that restricts *column* to the
+    *pmids*.
+
+    Up to `BULK_KEY_LIMIT` PMIDs are used as an ``IN`` list; Otherwise, the
+    PMIDs are loaded into a temporary table (with a name of its own) on the
+    connection *conn* and the clause is a sub-select against that table,
+    which is dropped on exit. Therefore, any statement using the clause has
+    to be executed on *conn* (or the `Session` that *conn* belongs to) inside
+    the ``with`` block. If the block raises an error, it is not masked by a
+    failing drop (e.g., in an aborted PostgreSQL transaction, whose rollback
+    removes the table anyway).
+    """
+    pmids = set(pmids)
+
+    if len(pmids) <= BULK_KEY_LIMIT:
+        yield column.in_(pmids)
+    else:
+        logger.debug("loading %i PMIDs into a temporary table", len(pmids))
+        keys = _PmidKeys()
+        keys.create(conn)
+
+        try:
+            conn.execute(keys.insert(), [{'pmid': pmid} for pmid in pmids])
+            yield column.in_(select([keys.c.pmid]))
+        except BaseException:
+            try:
+                keys.drop(conn)
+            except DatabaseError:
+                logger.debug("dropping the temporary table %s failed", keys.name, exc_info=True)
+
+            raise
+
+        keys.drop(conn)
+
+
 def _fetch_first(query) -> RowProxy:
     "Given a *query*, fetch the first row and return the first element or ``None``."
     conn = _db.engine.connect()
@@ -102,6 +162,22 @@ def _fetch_all(query) -> iter([RowProxy]):
         conn.close()
 
 
+def _fetch_for_pmids(build, column, pmids: list) -> iter([RowProxy]):
+    """
+    Fetch and return all rows of the query made by *build*, a function that
+    takes a clause restricting *column* to the *pmids* (see `PmidFilter`).
+    """
+    conn = _db.engine.connect()
+
+    try:
+        with PmidFilter(conn, column, pmids) as clause:
+            query = build(clause)
+            logger.debug("%s", query)
+            return conn.execute(query).fetchall()
+    finally:
+        conn.close()
+
+
 class SelectMixin(object):
     """
     Mixin for child tables to select rows (and columns)
@@ -252,10 +328,10 @@ class Identifier(_Base, SelectMixin):
             return {}
 
         t = cls.__table__
-        query = select(
-            [t.c.pmid, t.c.value], (t.c.namespace == 'doi') & t.c.pmid.in_(pmids)
+        mappings = _fetch_for_pmids(
+            lambda clause: select([t.c.pmid, t.c.value], (t.c.namespace == 'doi') & clause),
+            t.c.pmid, pmids
         )
-        mappings = _fetch_all(query)
         return dict(mappings) if mappings is not None else {}
 
 
@@ -751,6 +827,8 @@ class Medline(_Base):
             the record's revision date
         modified
             the date the record was last modified in the DB
+        digest
+            a hash over the content of the whole citation (see `medic.rows.Digest`)
 
     Relations:
 
@@ -823,10 +901,11 @@ class Medline(_Base):
     completed = Column(Date, nullable=True)
     revised = Column(Date, nullable=True)
     modified = Column(Date, default=date.today, onupdate=date.today, nullable=False)
+    digest = Column(String(length=32), nullable=True)
 
     def __init__(self, pmid: int, status: str, journal: str, pub_date: str,
                  created: date, completed: date=None, revised: date=None,
-                 issue: str=None, pagination: str=None):
+                 issue: str=None, pagination: str=None, digest: str=None):
         assert pmid > 0, pmid
         assert status in Medline.STATES, repr(status)
         assert journal, repr(journal)
@@ -845,13 +924,15 @@ class Medline(_Base):
         self.created = created
         self.completed = completed
         self.revised = revised
+        self.digest = digest
 
     def __str__(self):
         return '{}\n'.format('\t'.join(map(str, [
             NULL(self.pmid), NULL(self.status), NULL(self.journal),
             NULL(self.pub_date), NULL(self.issue), NULL(self.pagination),
             DATE(self.created), DATE(self.completed), DATE(self.revised),
-            DATE(date.today() if self.modified is None else self.modified)
+            DATE(date.today() if self.modified is None else self.modified),
+            NULL(self.digest)
         ])))
 
     def __repr__(self):
@@ -917,8 +998,7 @@ class Medline(_Base):
         mapping = {col.key: col for col in c}
         columns = [mapping[name] for name in attributes]
         columns.insert(0, c.pmid)
-        query = select(columns, c.pmid.in_(pmids))
-        return _fetch_all(query)
+        return _fetch_for_pmids(lambda clause: select(columns, clause), c.pmid, pmids)
 
     @classmethod
     def selectAll(cls, pmids: list) -> iter([RowProxy]):
@@ -931,8 +1011,7 @@ class Medline(_Base):
             return []
 
         c = cls.__table__.c
-        query = select([cls.__table__], c.pmid.in_(pmids))
-        return _fetch_all(query)
+        return _fetch_for_pmids(lambda clause: select([cls.__table__], clause), c.pmid, pmids)
 
     @classmethod
     def delete(cls, primary_keys: list):
@@ -944,12 +1023,13 @@ class Medline(_Base):
             return
 
         t = cls.__table__
-        query = t.delete(t.c.pmid.in_(primary_keys))
         conn = _db.engine.connect()
         transaction = conn.begin()
 
         try:
-            conn.execute(query)
+            with PmidFilter(conn, t.c.pmid, primary_keys) as clause:
+                conn.execute(t.delete(clause))
+
             transaction.commit()
         except:
             transaction.rollback()
@@ -964,13 +1044,8 @@ class Medline(_Base):
             return set()
 
         c = cls.__table__.c
-        query = select([c.pmid], c.pmid.in_(pmids))
-        conn = _db.engine.connect()
-
-        try:
-            return {row[0] for row in conn.execute(query)}
-        finally:
-            conn.close()
+        rows = _fetch_for_pmids(lambda clause: select([c.pmid], clause), c.pmid, pmids)
+        return {row[0] for row in rows}
 
     @classmethod
     def missing(cls, pmids: list) -> set:
@@ -987,12 +1062,54 @@ class Medline(_Base):
             return set()
 
         c = cls.__table__.c
-        query = select(
-            [c.pmid], c.pmid.in_(pmids) & (c.modified < before)
+        rows = _fetch_for_pmids(
+            lambda clause: select([c.pmid], clause & (c.modified < before)), c.pmid, pmids
         )
-        conn = _db.engine.connect()
+        return set(row[0] for row in rows)
 
-        try:
-            return set(row[0] for row in conn.execute(query))
-        finally:
-            conn.close()
+
+class Manifest(_Base):
+    """
+    A MEDLINE (baseline or update) file that has been applied to the DB.
+
+    Attributes:
+
+        name
+            the file's name (without its directory)
+        checksum
+            an MD5 hex digest of the file's content
+        records
+            the number of citations loaded from the file
+        applied
+            the date and time the file was applied
+        seconds
+            the time it took to apply the file
+
+    Primary Key: ``name``
+    """
+
+    __tablename__ = 'manifest'
+
+    name = Column(Unicode(length=256), CheckConstraint("name <> ''"), primary_key=True)
+    checksum = Column(String(length=32), nullable=False)
+    records = Column(Integer, nullable=False)
+    applied = Column(DateTime, nullable=False)
+    seconds = Column(Float, nullable=False)
+
+    def __init__(self, name: str, checksum: str, records: int, applied: datetime,
+                 seconds: float):
+        assert name, repr(name)
+        assert records >= 0, records
+        self.name = name
+        self.checksum = checksum
+        self.records = records
+        self.applied = applied
+        self.seconds = seconds
+
+    def __repr__(self):
+        return "Manifest<{}>".format(self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, Manifest) and \
+               self.name == other.name and \
+               self.checksum == other.checksum
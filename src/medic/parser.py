@@ -8,13 +8,19 @@
 import logging
 import re
 import struct
-import types
 
+from inspect import isgeneratorfunction
+from itertools import chain
+from io import BytesIO, TextIOBase
 from xml.etree.ElementTree import iterparse
 from datetime import date
 
-from medic.orm import Medline, Section, Author, Descriptor, Qualifier, Database, Identifier, \
-        Chemical, Keyword, PublicationType
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+from medic import orm, rows as row_types
 
 __all__ = ['MedlineXMLParser', 'PubMedXMLParser']
 
@@ -24,6 +30,12 @@ MONTHS_SHORT = (None, 'jan', 'feb', 'mar', 'apr', 'may', 'jun',
 
 logger = logging.getLogger(__name__)
 
+TABLES = frozenset({
+    'records', 'sections', 'authors', 'descriptors', 'qualifiers', 'identifiers',
+    'databases', 'publication_types', 'chemicals', 'keywords',
+})
+"""The names of all tables the parsers create instances for."""
+
 
 class State:
     UNDEFINED = 0
@@ -31,19 +43,133 @@ class State:
     SKIPPING = -1
 
 
+class ElementTreeEngine:
+    """
+    The StdLib's `xml.etree.ElementTree.iterparse` engine (delivers all elements).
+
+    As ElementTree elements have no reference to their parent, this engine
+    always delivers start events (to capture the root element for pruning).
+    """
+
+    name = 'etree'
+
+    def __init__(self):
+        self.root = None
+
+    def iterparse(self, xml_stream, events: tuple, tags: frozenset) -> iter:
+        stream = iterparse(xml_stream, ('start', 'end'))
+
+        try:
+            first = next(stream)
+        except StopIteration:
+            return iter(())
+
+        self.root = first[1]
+        return chain((first,), stream)
+
+    def prune(self, element):
+        """
+        Clear a fully processed *element* and detach it (and all other
+        processed elements) from the root to parse in constant memory.
+        """
+        element.clear()
+
+        if self.root is not None:
+            del self.root[:]
+
+
+class LxmlEngine:
+    """
+    An `lxml.etree.iterparse` engine that only delivers the elements
+    with one of the *tags* the parser has handlers for.
+    """
+
+    name = 'lxml'
+
+    def iterparse(self, xml_stream, events: tuple, tags: frozenset) -> iter:
+        if isinstance(xml_stream, TextIOBase):
+            # lxml can only parse byte streams
+            if hasattr(xml_stream, 'buffer'):
+                xml_stream = xml_stream.buffer
+            else:
+                xml_stream = BytesIO(xml_stream.read().encode('utf-8'))
+
+        return lxml_etree.iterparse(
+            xml_stream, events=events or ('end',), tag=tags, remove_comments=True
+        )
+
+    def prune(self, element):
+        """
+        Clear a fully processed *element* and delete all preceding siblings
+        of it and its ancestors to parse in constant memory.
+        """
+        element.clear()
+        node = element
+
+        while node is not None:
+            parent = node.getparent()
+
+            if parent is not None:
+                while node.getprevious() is not None:
+                    del parent[0]
+
+            node = parent
+
+
+ENGINES = {ElementTreeEngine.name: ElementTreeEngine, LxmlEngine.name: LxmlEngine}
+"""The available parsing engines (by name)."""
+
+DEFAULT_ENGINE = ElementTreeEngine.name if lxml_etree is None else LxmlEngine.name
+"""The engine used if none is requested: lxml, if it is installed."""
+
+
+def Engine(name: str=None):
+    """
+    Return an instance of the parsing engine with the given *name*
+    (`DEFAULT_ENGINE` if ``None``), falling back to the ElementTree engine
+    if lxml is requested, but not installed.
+    """
+    if name is None:
+        name = DEFAULT_ENGINE
+    elif name == LxmlEngine.name and lxml_etree is None:
+        logger.warning('lxml not installed; falling back to the %s engine',
+                       ElementTreeEngine.name)
+        name = ElementTreeEngine.name
+
+    return ENGINES[name]()
+
+
 class Parser:
     """A basic parser implementation for NLM XML citations."""
 
-    def __init__(self, unique=True):
+    UNSKIPPABLE = frozenset({'PMID', 'DeleteCitation'})
+    """Tags that are handled even while skipping a citation."""
+
+    HANDLER_TABLES = {'MedlineCitation': 'records'}
+    """The table each handler creates instances for (other handlers are always used)."""
+
+    def __init__(self, unique=True, engine=None, rows=False, tables=None):
         """
         Create a new parser.
 
         :param unique: if `True`, citations with VersionID != "1" are skipped
+        :param engine: the name of the parsing engine to use (see `Engine`)
+        :param rows: if `True`, lightweight `medic.rows` are created instead
+                     of `medic.orm` instances
+        :param tables: if given, only instances for these `TABLES` are created
+                       (``records`` are always created, and ``qualifiers``
+                       require ``descriptors``)
         """
-        logger.info('configuring a %sunique %s',
-                    "" if unique else "non-", self.__class__.__name__)
+        self.engine = Engine(engine)
+        self.model = row_types if rows else orm
+        logger.info('configuring a %sunique %s (%s)',
+                    "" if unique else "non-", self.__class__.__name__, self.engine.name)
         self.unique = unique
         self.events = ('start', 'end') if unique else None
+        self.tables = TABLES if tables is None else Projection(tables)
+        self.dispatch = self.dispatchTable()
+        self.tags = frozenset(self.dispatch)
+        self.debug = logger.isEnabledFor(logging.DEBUG)
         logger.debug('state: UNDEFINED')
         self._state = State.UNDEFINED
         self.pmid = -1
@@ -72,19 +198,58 @@ class Parser:
     def isParsing(self):
         return State.PARSING == self._state
 
+    @classmethod
+    def handlers(cls) -> dict:
+        """
+        Return the mapping of element tags to this class' handler functions.
+
+        Handlers are all callable attributes with an upper-case initial;
+        the mapping is computed only once per (sub-) class.
+        """
+        if '_handlers' not in cls.__dict__:
+            cls._handlers = {
+                name: getattr(cls, name) for name in dir(cls)
+                if name[0].isupper() and callable(getattr(cls, name))
+            }
+
+        return cls._handlers
+
+    @classmethod
+    def handledTags(cls) -> frozenset:
+        "Return the `frozenset` of element tags this parser has handlers for."
+        return frozenset(cls.handlers())
+
+    def dispatchTable(self) -> dict:
+        """
+        Return a mapping of element tags to ``(bound_handler, is_generator)``
+        tuples for this parser instance.
+
+        Handlers for tables that are not in the instance's `tables` are left
+        out, so their elements are never even reported by the engine.
+        """
+        return {
+            tag: (getattr(self, tag), isgeneratorfunction(function))
+            for tag, function in self.handlers().items()
+            if self.HANDLER_TABLES.get(tag, 'records') in self.tables
+        }
+
     def parse(self, xml_stream):
+        dispatch = self.dispatch
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+
         try:
-            for event, element in iterparse(xml_stream, self.events):
-                if event == 'start':
+            for event, element in self.engine.iterparse(xml_stream, self.events, self.tags):
+                if event == 'end':
+                    if element.tag in dispatch:
+                        for instance in self.yieldInstances(element):
+                            yield instance
+                elif self.unique:
                     self.startElement(element)
-                else:
-                    for instance in self.yieldInstances(element):
-                        yield instance
         except struct.error:
             logger.exception('compressed gzip file is corrupt')
 
     def startElement(self, element):
-        if self.unique and element.tag == 'MedlineCitation':
+        if element.tag == 'MedlineCitation':
             version = element.get('VersionID')
 
             if version is not None and version.strip() != "1":
@@ -92,29 +257,32 @@ class Parser:
                 self.skipping()
 
     def yieldInstances(self, element):
-        if element.tag == 'PMID':
-            self.PMID(element)
-        elif element.tag == 'DeleteCitation':
-            for pmid in self.DeleteCitation(element):
-                yield pmid
-        elif self.isSkipping():
-            if element.tag == 'MedlineCitation':
+        tag = element.tag
+
+        if tag not in self.dispatch:
+            return
+        elif self._state == State.SKIPPING and tag not in Parser.UNSKIPPABLE:
+            if tag == 'MedlineCitation':
                 self.undefined()
-        elif hasattr(self, element.tag):
-            logger.debug('processing %s', element.tag)
-            instance = getattr(self, element.tag)(element)
 
-            if instance is not None:
-                logger.debug('parsed %s', element.tag)
+            return
 
-                if isinstance(instance, types.GeneratorType):
-                    for i in instance:
-                        if i is not None:
-                            yield i
-                else:
-                    yield instance
-            else:
-                logger.debug('ignored %s', element.tag)
+        handler, is_generator = self.dispatch[tag]
+
+        if self.debug:
+            logger.debug('processing %s', tag)
+
+        if is_generator:
+            for i in handler(element):
+                if i is not None:
+                    yield i
+        else:
+            instance = handler(element)
+
+            if instance is not None:
+                yield instance
+            elif self.debug:
+                logger.debug('ignored %s', tag)
 
     def DeleteCitation(self, element):
         for pmid in element.findall('PMID'):
@@ -145,7 +313,7 @@ class Parser:
         if pagination:
             options['pagination'] = pagination
 
-        return Medline(self.pmid, status, journal, pub_date, created, **options)
+        return self.model.Medline(self.pmid, status, journal, pub_date, created, **options)
 
     def parsePubDate(self, element):
         medline = element.find('MedlineDate')
@@ -204,6 +372,15 @@ class Parser:
 class MedlineXMLParser(Parser):
     """A parser for (offline) MEDLINE XML (files)."""
 
+    HANDLER_TABLES = dict(
+        Parser.HANDLER_TABLES,
+        Abstract='sections', ArticleTitle='sections', OtherAbstract='sections',
+        VernacularTitle='sections', AuthorList='authors', ChemicalList='chemicals',
+        DataBank='databases', ELocationID='identifiers', OtherID='identifiers',
+        KeywordList='keywords', MeshHeadingList='descriptors',
+        PublicationType='publication_types',
+    )
+
     def __init__(self, *args, **kwargs):
         super(MedlineXMLParser, self).__init__(*args, **kwargs)
         self.seq = 0
@@ -227,19 +404,19 @@ class MedlineXMLParser(Parser):
         self.seq += 1
         name = element.get('NlmCategory', 'Abstract').capitalize()
         name = '{}{}'.format(other, name) if other else name
-        return Section(
+        return self.model.Section(
             self.pmid, self.seq, name, text, element.get('Label', None)
         )
 
     def parseCopyrightInformation(self, element, other=None):
         name = '{}Copyright'.format(other) if other else 'Copyright'
         self.seq += 1
-        return Section(self.pmid, self.seq, name, element.text.strip())
+        return self.model.Section(self.pmid, self.seq, name, element.text.strip())
 
     def ArticleTitle(self, element):
         if element.text is not None:
             self.seq += 1
-            return Section(self.pmid, self.seq, 'Title', element.text.strip())
+            return self.model.Section(self.pmid, self.seq, 'Title', element.text.strip())
 
     def AuthorList(self, element):
         for pos, author in enumerate(element.getchildren()):
@@ -253,7 +430,7 @@ class MedlineXMLParser(Parser):
             forename = None
 
         if name is not None:
-            return Author(self.pmid, pos + 1, name, initials, forename, suffix)
+            return self.model.Author(self.pmid, pos + 1, name, initials, forename, suffix)
         else:
             logger.warning('empty or missing Author/LastName or CollectiveName in %i',
                            self.pmid)
@@ -303,7 +480,7 @@ class MedlineXMLParser(Parser):
                 uid = e.text.strip()
 
             name = chemical.find('NameOfSubstance')
-            yield Chemical(self.pmid, idx + 1, name.text.strip(), uid)
+            yield self.model.Chemical(self.pmid, idx + 1, name.text.strip(), uid)
 
     def DataBank(self, element):
         name = element.find('DataBankName')
@@ -314,14 +491,14 @@ class MedlineXMLParser(Parser):
             for acc in element.find('AccessionNumberList').getchildren():
                 if acc.text and acc.text not in done:
                     done.add(acc.text)
-                    yield Database(self.pmid, name.text, acc.text)
+                    yield self.model.Database(self.pmid, name.text, acc.text)
 
     def ELocationID(self, element):
         ns = element.get('EIdType').strip().lower()
 
         if ns not in self.namespaces:
             self.namespaces.add(ns)
-            return Identifier(self.pmid, ns, element.text.strip())
+            return self.model.Identifier(self.pmid, ns, element.text.strip())
 
     def KeywordList(self, element):
         owner = element.get('Owner', 'NLM').strip().upper()
@@ -329,14 +506,14 @@ class MedlineXMLParser(Parser):
 
         for cnt, keyword in enumerate(element.getchildren()):
             if keyword.text is not None:
-                yield Keyword(
+                yield self.model.Keyword(
                     self.pmid, owner, cnt + 1, keyword.text.strip(),
                     keyword.get('MajorTopicYN', 'N') == 'Y',
                 )
 
     def MedlineCitation(self, element):
         instance = Parser.MedlineCitation(self, element)
-        element.clear()
+        self.engine.prune(element)
         self.undefined()
         return instance
 
@@ -347,18 +524,21 @@ class MedlineXMLParser(Parser):
             if descriptor is not None and descriptor.text:
                 yield self.parseDescriptor(num, descriptor)
 
+            if 'qualifiers' not in self.tables:
+                continue
+
             for sub, qualifier in enumerate(mesh.findall('QualifierName')):
                 if qualifier.text:
                     yield self.parseQualifier(num, sub, qualifier)
 
     def parseDescriptor(self, num, element):
-        return Descriptor(
+        return self.model.Descriptor(
             self.pmid, num + 1, element.text.strip(),
             element.get('MajorTopicYN', 'N') == 'Y',
         )
 
     def parseQualifier(self, num, sub, element):
-        return Qualifier(
+        return self.model.Qualifier(
             self.pmid, num + 1, sub + 1, element.text.strip(),
             element.get('MajorTopicYN', 'N') == 'Y',
         )
@@ -380,26 +560,28 @@ class MedlineXMLParser(Parser):
             if text.startswith('PMC'):
                 if 'pmc' not in self.namespaces:
                     self.namespaces.add('pmc')
-                    return Identifier(self.pmid, 'pmc', text.split(' ', 1)[0])
+                    return self.model.Identifier(self.pmid, 'pmc', text.split(' ', 1)[0])
 
     def PublicationType(self, element):
         if element.text:
-            return PublicationType(self.pmid, element.text.strip())
+            return self.model.PublicationType(self.pmid, element.text.strip())
 
     def VernacularTitle(self, element):
         if element.text is not None:
             self.seq += 1
-            return Section(self.pmid, self.seq, 'Vernacular', element.text.strip())
+            return self.model.Section(self.pmid, self.seq, 'Vernacular', element.text.strip())
 
 
 class PubMedXMLParser(MedlineXMLParser):
     """A parser for PubMed (eUtils, online) XML."""
 
+    HANDLER_TABLES = dict(MedlineXMLParser.HANDLER_TABLES, ArticleId='identifiers')
+
     def __init__(self, *args, **kwargs):
         super(PubMedXMLParser, self).__init__(*args, **kwargs)
 
     def PubmedArticle(self, element):
-        element.clear()
+        self.engine.prune(element)
         self.undefined()
 
     def ArticleId(self, element):
@@ -411,12 +593,12 @@ class PubMedXMLParser(MedlineXMLParser):
             if re.match('\d[\d\.]+/.+', element.text.strip()) and \
                     'doi' not in self.namespaces:
                 self.namespaces.add('doi')
-                instance = Identifier(self.pmid, 'doi', text)
+                instance = self.model.Identifier(self.pmid, 'doi', text)
             else:
                 logger.info('skipping duplicate %s identifier "%s"', ns, text)
         else:
             self.namespaces.add(ns)
-            instance = Identifier(self.pmid, ns, text)
+            instance = self.model.Identifier(self.pmid, ns, text)
 
         return instance
 
@@ -425,6 +607,24 @@ class PubMedXMLParser(MedlineXMLParser):
         return Parser.MedlineCitation(self, element)
 
 
+def Projection(tables: iter) -> frozenset:
+    """
+    Return the `frozenset` of *tables* to parse, always including ``records``.
+
+    :raises ValueError: if any of the *tables* is unknown, or ``qualifiers``
+                        are requested without their ``descriptors``
+    """
+    tables = frozenset(tables) | {'records'}
+    unknown = tables - TABLES
+
+    if unknown:
+        raise ValueError('unknown tables: {}'.format(', '.join(sorted(unknown))))
+    elif 'qualifiers' in tables and 'descriptors' not in tables:
+        raise ValueError('qualifiers require descriptors')
+
+    return tables
+
+
 def ParseDate(date_element):
     """Parse a **valid** date that (at least) has to have a Year element."""
     year = int(date_element.find('Year').text)
@@ -0,0 +1,214 @@
+"""
+.. py:module:: medic.pgcopy
+   :synopsis: Writing PostgreSQL binary COPY files.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+
+The files can be loaded with ``COPY table FROM 'file' WITH (FORMAT binary)``;
+See http://www.postgresql.org/docs/current/static/sql-copy.html
+for the format's specification. Text values are encoded as UTF-8,
+so the target DB should use the UTF8 encoding.
+"""
+from datetime import date
+from io import SEEK_END
+from struct import Struct, calcsize
+from sqlalchemy.types import BigInteger, Boolean, Date, Integer, SmallInteger, String
+
+from medic.orm import Medline, Section, Author, Descriptor, Qualifier, Database, Identifier, \
+        Chemical, Keyword, PublicationType
+
+HEADER = b'PGCOPY\n\xff\r\n\x00' + Struct('!ii').pack(0, 0)
+"""The file signature, flags field, and (empty) header extension."""
+
+TRAILER = Struct('!h').pack(-1)
+"""The file trailer (a tuple field count of -1)."""
+
+NULL = Struct('!i').pack(-1)
+"""A NULL field (length -1)."""
+
+EPOCH = date(2000, 1, 1).toordinal()
+"""PostgreSQL dates are binary-encoded as days since 2000-01-01."""
+
+_LENGTH = Struct('!i')
+
+_DEFAULTS = {
+    (Medline.__tablename__, 'modified'): date.today,
+}
+
+_FIXED_WIDTH = (
+    # (column type, struct format of length and value, value conversion)
+    (Boolean, 'i?', None),
+    (SmallInteger, 'ih', None),
+    (BigInteger, 'iq', None),
+    (Integer, 'ii', None),
+    (Date, 'ii', lambda value: value.toordinal() - EPOCH),
+)
+
+
+def _fixedWidth(column_type) -> tuple:
+    "Return the ``(struct_format, conversion)`` for a fixed-width *column_type* or ``None``."
+    for klass, fmt, convert in _FIXED_WIDTH:
+        if isinstance(column_type, klass):
+            return fmt, convert
+
+    if isinstance(column_type, String):  # including Unicode, UnicodeText, and Enum
+        return None
+    else:
+        raise TypeError('no binary encoding for {!r}'.format(column_type))
+
+
+def _tableEncoder(klass):
+    """
+    Return a function that encodes an instance of *klass* as a binary tuple.
+
+    The field count and the leading run of non-nullable fixed-width columns
+    (typically, the primary key) are packed with a single `struct.Struct`.
+    """
+    columns = list(klass.__table__.columns)
+    field_count = len(columns)
+    head_fmt = ['!h']
+    head_names = []
+    sizes = []
+
+    while columns and not columns[0].nullable:
+        fixed = _fixedWidth(columns[0].type)
+
+        if fixed is None or fixed[1] is not None:
+            break
+
+        head_fmt.append(fixed[0])
+        head_names.append(columns.pop(0).key)
+        sizes.append(calcsize('!' + fixed[0][1]))
+
+    head = Struct(''.join(head_fmt))
+    tail = []
+
+    for col in columns:
+        fixed = _fixedWidth(col.type)
+        default = _DEFAULTS.get((klass.__tablename__, col.key))
+
+        if fixed is None:
+            tail.append((col.key, None, None, default))
+        else:
+            fmt, convert = fixed
+            value_struct = Struct('!' + fmt)
+            tail.append((col.key, value_struct, convert, default))
+
+    def encode(instance) -> bytes:
+        values = [field_count]
+
+        for name, size in zip(head_names, sizes):
+            values.append(size)
+            values.append(getattr(instance, name))
+
+        parts = [head.pack(*values)]
+
+        for name, value_struct, convert, default in tail:
+            value = getattr(instance, name, None)
+
+            if value is None:
+                if default is None:
+                    parts.append(NULL)
+                    continue
+
+                value = default()
+
+            if value_struct is None:
+                data = value.encode('utf-8')
+                parts.append(_LENGTH.pack(len(data)))
+                parts.append(data)
+            else:
+                if convert is not None:
+                    value = convert(value)
+
+                parts.append(value_struct.pack(value_struct.size - 4, value))
+
+        return b''.join(parts)
+
+    return encode
+
+
+ENCODERS = {
+    klass.__tablename__: _tableEncoder(klass) for klass in (
+        Medline, Section, Author, Descriptor, Qualifier, Database, Identifier,
+        Chemical, Keyword, PublicationType
+    )
+}
+"""The binary tuple encoder function for each table."""
+
+
+def Encode(instance) -> bytes:
+    "Encode an ORM instance or `medic.rows` row as a binary COPY tuple."
+    return ENCODERS[instance.__tablename__](instance)
+
+
+class Writer:
+    """
+    A binary COPY file writer for encoded tuples (see `Encode`).
+
+    Files without any tuples are left empty (i.e., without header or trailer).
+    To *append* tuples, the file at *path* has to end after its last tuple
+    (i.e., without the trailer).
+    """
+
+    def __init__(self, path: str, append: bool=False):
+        self.name = path
+
+        if append:
+            self.stream = open(path, 'ab')
+        else:
+            self.stream = open(path, 'wb')
+            self.stream.write(HEADER)
+
+        self.write = self.stream.write
+        self.flush = self.stream.flush
+
+    def close(self):
+        if self.stream.tell() == len(HEADER):
+            self.stream.seek(0)
+            self.stream.truncate()
+        else:
+            self.stream.write(TRAILER)
+
+        self.stream.close()
+
+
+def Concatenate(paths: list, target: str, buffer_size: int=1 << 20):
+    """
+    Concatenate the tuples of the binary COPY files at *paths* into one
+    file at *target* (empty files are skipped).
+    """
+    tuples = False
+
+    with open(target, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as stream:
+                size = stream.seek(0, SEEK_END)
+
+                if not size:
+                    continue
+
+                stream.seek(size - len(TRAILER))
+
+                if stream.read() != TRAILER:
+                    raise ValueError('{} has no binary COPY trailer'.format(path))
+
+                stream.seek(0)
+
+                if stream.read(len(HEADER)) != HEADER:
+                    raise ValueError('{} has no binary COPY header'.format(path))
+
+                if not tuples:
+                    out.write(HEADER)
+                    tuples = True
+
+                remaining = size - len(HEADER) - len(TRAILER)
+
+                while remaining:
+                    data = stream.read(min(buffer_size, remaining))
+                    out.write(data)
+                    remaining -= len(data)
+
+        if tuples:
+            out.write(TRAILER)
@@ -0,0 +1,165 @@
+"""
+.. py:module:: medic.pipeline
+   :synopsis: Running processing stages concurrently, connected by bounded queues.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+"""
+import logging
+
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from time import time
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 4
+"""The default number of items each queue between two stages holds."""
+
+_DONE = object()
+# marks the end of a stage's output
+
+
+class Stage:
+    """
+    The metrics of a pipeline stage: the number of `items` it produced, the
+    `seconds` it spent working on them, and the `max_depth` and mean `depth`
+    of its output queue (when an item was put onto it).
+    """
+
+    def __init__(self, name: str, function=None):
+        self.name = name
+        self.function = function
+        self.items = 0
+        self.seconds = 0.0
+        self.max_depth = 0
+        self.depths = 0
+
+    @property
+    def throughput(self) -> float:
+        "The number of items produced per working second."
+        return self.items / self.seconds if self.seconds else 0.0
+
+    @property
+    def depth(self) -> float:
+        "The mean depth of the stage's output queue."
+        return self.depths / self.items if self.items else 0.0
+
+    def __str__(self):
+        return '{}: {} items in {:.1f} s ({:.1f}/s), queue depth {:.1f} (max {})'.format(
+            self.name, self.items, self.seconds, self.throughput, self.depth, self.max_depth
+        )
+
+
+class Pipeline:
+    """
+    Iterate over the *source* in one thread and apply each function of the
+    (*name*, *function*) *stages* to the items in a thread of its own; The
+    stages are connected by queues of *size* items, and the consumer that
+    iterates over the pipeline is the last stage (called *sink*).
+
+    Therefore, all stages work at the same time, and the pipeline runs as
+    fast as its slowest stage. An error in any stage ends the stream and is
+    raised to the consumer once it has received all items produced before
+    the error; If the consumer stops iterating, all stages are stopped.
+    The `stages` hold each stage's metrics (see `Stage`), which are logged
+    (with ``--info``) once the pipeline is done.
+    """
+
+    def __init__(self, source: iter, stages: list=(), sink: str='sink', size: int=QUEUE_SIZE):
+        self.source = source
+        self.stages = [Stage('source')] + [Stage(name, fn) for name, fn in stages] + [Stage(sink)]
+        self.size = size
+        self.stopped = Event()
+        self.error = None
+
+    def __iter__(self):
+        threads = []
+        queue = None
+
+        for stage in self.stages[:-1]:
+            output = Queue(self.size)
+            thread = Thread(target=self._run, args=(stage, queue, output), daemon=True)
+            thread.start()
+            threads.append(thread)
+            queue = output
+
+        sink = self.stages[-1]
+
+        try:
+            for item in self._items(queue):
+                start = time()
+                yield item
+                sink.items += 1
+                sink.seconds += time() - start
+
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.stopped.set()
+
+            for thread in threads:
+                thread.join()
+
+            for stage in self.stages:
+                logger.info('%s', stage)
+
+    def _run(self, stage: Stage, input: Queue, output: Queue):
+        items = iter(self.source) if input is None else self._items(input)
+
+        try:
+            start = time()
+
+            for item in items:
+                if stage.function is not None:
+                    start = time()
+                    item = stage.function(item)
+
+                stage.seconds += time() - start
+                stage.items += 1
+                depth = output.qsize()
+                stage.depths += depth
+                stage.max_depth = max(stage.max_depth, depth)
+
+                if not self._put(output, item):
+                    return
+
+                start = time()
+
+            self._put(output, _DONE)
+        except Exception as e:
+            # end the stream, so the items before the error reach the consumer
+            if self.error is None:
+                self.error = e
+
+            self._put(output, _DONE)
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+    def _items(self, input: Queue) -> iter:
+        "Yield the items on the *input* queue until it is done or the pipeline stopped."
+        while True:
+            try:
+                item = input.get(timeout=0.1)
+            except Empty:
+                if self.stopped.is_set():
+                    return
+
+                continue
+
+            if item is _DONE:
+                return
+
+            yield item
+
+    def _put(self, output: Queue, item) -> bool:
+        "Put the *item* on the *output* queue, unless the pipeline stopped."
+        while not self.stopped.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+
+        return False
@@ -0,0 +1,256 @@
+"""
+.. py:module:: medic.rows
+   :synopsis: Lightweight row records for the parse-to-dump path.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU Affero GPL v3 (http://www.gnu.org/licenses/agpl.html)
+
+The row classes share the names, constructor signatures, ``__tablename__``,
+and ``__str__`` format of their `medic.orm` counterparts, but are plain
+``__slots__`` objects without SQLAlchemy instrumentation or value assertions.
+Use `Row.toOrm` to create the ORM instance when a row should be added to a
+`sqlalchemy.orm.Session`.
+"""
+from datetime import date
+from hashlib import md5
+
+from medic import orm
+from medic.orm import NULL, DATE, STRING
+
+__all__ = [
+    'Medline', 'Author', 'Chemical', 'Database', 'Descriptor',
+    'Identifier', 'Keyword', 'Qualifier', 'Section', 'PublicationType'
+]
+
+
+def Digest(citation: list) -> str:
+    """
+    Return a stable content hash (an MD5 hex digest) over all rows of a
+    *citation*, independent of the rows' order and any digest already set.
+    """
+    lines = sorted(repr((row.__tablename__,) + tuple(
+        getattr(row, name) for name in row.__slots__ if name != 'digest'
+    )) for row in citation)
+    return md5('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+class Row:
+    """
+    The base class of all rows.
+
+    Subclasses list their ``__slots__`` in the order of the ORM class'
+    constructor arguments.
+    """
+
+    __slots__ = ()
+    __tablename__ = None
+    ORM = None
+    """The `medic.orm` class this row represents."""
+
+    def toOrm(self):
+        "Create the ORM instance for this row."
+        return self.ORM(*[getattr(self, name) for name in self.__slots__])
+
+    def toDict(self) -> dict:
+        "Return the column values of this row as a `dict` (e.g., for Core inserts)."
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "{}<{}>".format(self.__class__.__name__, ':'.join(
+            str(getattr(self, name)) for name in self.__slots__
+        ))
+
+    def __eq__(self, other):
+        return type(self) == type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+
+class Identifier(Row):
+    __slots__ = ('pmid', 'namespace', 'value')
+    __tablename__ = orm.Identifier.__tablename__
+    ORM = orm.Identifier
+
+    def __init__(self, pmid: int, namespace: str, value: str):
+        self.pmid = pmid
+        self.namespace = namespace
+        self.value = value
+
+    def __str__(self):
+        return '{}\t{}\t{}\n'.format(
+            NULL(self.pmid), NULL(self.namespace), STRING(self.value)
+        )
+
+
+class Author(Row):
+    __slots__ = ('pmid', 'pos', 'name', 'initials', 'forename', 'suffix')
+    __tablename__ = orm.Author.__tablename__
+    ORM = orm.Author
+
+    def __init__(self, pmid: int, pos: int, name: str,
+                 initials: str=None, forename: str=None, suffix: str=None):
+        self.pmid = pmid
+        self.pos = pos
+        self.name = name
+        self.initials = initials
+        self.forename = forename
+        self.suffix = suffix
+
+    def __str__(self):
+        return "{}\t{}\t{}\t{}\t{}\t{}\n".format(
+            NULL(self.pmid), NULL(self.pos), STRING(self.name),
+            NULL(self.initials), NULL(self.forename), NULL(self.suffix))
+
+
+class Qualifier(Row):
+    __slots__ = ('pmid', 'num', 'sub', 'name', 'major')
+    __tablename__ = orm.Qualifier.__tablename__
+    ORM = orm.Qualifier
+
+    def __init__(self, pmid: int, num: int, sub: int, name: str, major: bool=False):
+        self.pmid = pmid
+        self.num = num
+        self.sub = sub
+        self.name = name
+        self.major = major
+
+    def __str__(self):
+        return '{}\t{}\t{}\t{}\t{}\n'.format(
+            NULL(self.pmid), NULL(self.num), NULL(self.sub),
+            'T' if self.major else 'F', STRING(self.name),
+        )
+
+
+class Descriptor(Row):
+    __slots__ = ('pmid', 'num', 'name', 'major')
+    __tablename__ = orm.Descriptor.__tablename__
+    ORM = orm.Descriptor
+
+    def __init__(self, pmid: int, num: int, name: str, major: bool=False):
+        self.pmid = pmid
+        self.num = num
+        self.name = name
+        self.major = major
+
+    def __str__(self):
+        return '{}\t{}\t{}\t{}\n'.format(
+            NULL(self.pmid), NULL(self.num), 'T' if self.major else 'F', STRING(self.name)
+        )
+
+
+class Chemical(Row):
+    __slots__ = ('pmid', 'idx', 'name', 'uid')
+    __tablename__ = orm.Chemical.__tablename__
+    ORM = orm.Chemical
+
+    def __init__(self, pmid: int, idx: int, name: str, uid: str=None):
+        self.pmid = pmid
+        self.idx = idx
+        self.name = name
+        self.uid = uid
+
+    def __str__(self):
+        return '{}\t{}\t{}\t{}\n'.format(
+            NULL(self.pmid), NULL(self.idx), NULL(self.uid), STRING(self.name)
+        )
+
+
+class PublicationType(Row):
+    __slots__ = ('pmid', 'value')
+    __tablename__ = orm.PublicationType.__tablename__
+    ORM = orm.PublicationType
+
+    def __init__(self, pmid: int, value: str):
+        self.pmid = pmid
+        self.value = value
+
+    def __str__(self):
+        return '{}\t{}\n'.format(NULL(self.pmid), NULL(self.value))
+
+
+class Database(Row):
+    __slots__ = ('pmid', 'name', 'accession')
+    __tablename__ = orm.Database.__tablename__
+    ORM = orm.Database
+
+    def __init__(self, pmid: int, name: str, accession: str):
+        self.pmid = pmid
+        self.name = name
+        self.accession = accession
+
+    def __str__(self):
+        return '{}\t{}\t{}\n'.format(
+            NULL(self.pmid), NULL(self.name), STRING(self.accession)
+        )
+
+
+class Keyword(Row):
+    __slots__ = ('pmid', 'owner', 'cnt', 'name', 'major')
+    __tablename__ = orm.Keyword.__tablename__
+    ORM = orm.Keyword
+
+    def __init__(self, pmid: int, owner: str, cnt: int, name: str, major: bool=False):
+        self.pmid = pmid
+        self.owner = owner
+        self.cnt = cnt
+        self.name = name
+        self.major = major
+
+    def __str__(self):
+        return '{}\t{}\t{}\t{}\t{}\n'.format(
+            NULL(self.pmid), NULL(self.owner), NULL(self.cnt),
+            'T' if self.major else 'F', STRING(self.name)
+        )
+
+
+class Section(Row):
+    __slots__ = ('pmid', 'seq', 'name', 'content', 'label')
+    __tablename__ = orm.Section.__tablename__
+    ORM = orm.Section
+
+    def __init__(self, pmid: int, seq: int, name: str, content: str, label: str=None):
+        self.pmid = pmid
+        self.seq = seq
+        self.name = name
+        self.content = content
+        self.label = label
+
+    def __str__(self):
+        return '{}\t{}\t{}\t{}\t{}\n'.format(
+            NULL(self.pmid), NULL(self.seq), NULL(self.name),
+            NULL(self.label), STRING(self.content)
+        )
+
+
+class Medline(Row):
+    __slots__ = ('pmid', 'status', 'journal', 'pub_date', 'created',
+                 'completed', 'revised', 'issue', 'pagination', 'digest')
+    __tablename__ = orm.Medline.__tablename__
+    ORM = orm.Medline
+
+    def __init__(self, pmid: int, status: str, journal: str, pub_date: str,
+                 created: date, completed: date=None, revised: date=None,
+                 issue: str=None, pagination: str=None, digest: str=None):
+        self.pmid = pmid
+        self.status = status
+        self.journal = journal
+        self.pub_date = pub_date
+        self.created = created
+        self.completed = completed
+        self.revised = revised
+        self.issue = issue
+        self.pagination = pagination
+        self.digest = digest
+
+    def toDict(self) -> dict:
+        values = super(Medline, self).toDict()
+        values['modified'] = date.today()
+        return values
+
+    def __str__(self):
+        return '{}\n'.format('\t'.join(map(str, [
+            NULL(self.pmid), NULL(self.status), NULL(self.journal),
+            NULL(self.pub_date), NULL(self.issue), NULL(self.pagination),
+            DATE(self.created), DATE(self.completed), DATE(self.revised),
+            DATE(date.today()), NULL(self.digest)
+        ])))
@@ -2,12 +2,21 @@ import unittest
 
 from collections import defaultdict
 from datetime import date
-from io import StringIO
-from tempfile import TemporaryFile
+from io import BytesIO, StringIO
+from os import listdir, mkdir
+from os.path import dirname, join
+from shutil import copyfileobj
+from sqlalchemy import event
+from sqlite3 import dbapi2
+from tempfile import NamedTemporaryFile, TemporaryDirectory, TemporaryFile
+from unittest.mock import patch
+from urllib.error import URLError
 
-from medic.orm import Medline, Section, Author, Descriptor, Qualifier, Database, Identifier, \
-        Chemical, Keyword, PublicationType
-from medic.crud import _dump
+from medic.orm import InitDb, Session, Medline, Section, Author, Descriptor, Qualifier, \
+        Database, Identifier, Chemical, Keyword, PublicationType, Manifest
+from medic.crud import apply, delete, dump, insert, load, select, sync, update, _dump, \
+        CHECKPOINT_FILE, DELETE_FILE, RELATIONS
+from medic.test.parser_test import SyntheticMedline
 
 DATA = [
     Section(1, 1, 'Title', 'The Title'),
@@ -73,5 +82,599 @@ class TestDump(unittest.TestCase):
             self.assertEqual(results[tbl], buff.getvalue())
 
 
+class TestParallelDump(unittest.TestCase):
+    MEDLINE_STRUCTURE_FILE = join(dirname(__file__), 'medline.xml')
+
+    def assertSameDump(self, files, jobs):
+        with TemporaryDirectory() as serial, TemporaryDirectory() as parallel:
+            dump(files, serial, False, True)
+            dump(files, parallel, False, True, jobs)
+            self.assertEqual(sorted(listdir(serial)), sorted(listdir(parallel)))
+
+            for name in listdir(serial):
+                with open(join(serial, name)) as a, open(join(parallel, name)) as b:
+                    self.assertEqual(a.read(), b.read(), name)
+
+    def testParallelDump(self):
+        self.assertSameDump([self.MEDLINE_STRUCTURE_FILE] * 3, 2)
+
+    def testMoreJobsThanFiles(self):
+        self.assertSameDump([self.MEDLINE_STRUCTURE_FILE] * 2, 4)
+
+    def testDumpTables(self):
+        with TemporaryDirectory() as output:
+            dump([self.MEDLINE_STRUCTURE_FILE] * 2, output, False, True, 2,
+                 tables=['sections', 'descriptors'])
+            self.assertEqual(['delete.txt', 'descriptors.tab', 'records.tab', 'sections.tab'],
+                             sorted(listdir(output)))
+
+    def testDumpUnknownTables(self):
+        with TemporaryDirectory() as output:
+            self.assertRaises(ValueError, dump, [self.MEDLINE_STRUCTURE_FILE], output, False,
+                              True, tables=['abstracts'])
+
+
+class TestResumeDump(unittest.TestCase):
+    MEDLINE_STRUCTURE_FILE = join(dirname(__file__), 'medline.xml')
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.broken = join(self.dir.name, 'broken.xml')
+
+        with open(self.MEDLINE_STRUCTURE_FILE) as stream:
+            self.xml = stream.read()
+
+        # the first citation is dumped before the parser fails
+        end = self.xml.index('</MedlineCitation>') + len('</MedlineCitation>')
+
+        with open(self.broken, 'w') as out:
+            out.write(self.xml[:end] + '<MedlineCitation><PMID>')
+
+        self.files = [self.MEDLINE_STRUCTURE_FILE, self.broken, self.MEDLINE_STRUCTURE_FILE]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def assertResumes(self, jobs, fmt='tab'):
+        with TemporaryDirectory() as clean, TemporaryDirectory() as resumed:
+            self.assertRaises(Exception, dump, self.files, resumed, False, True, jobs, fmt)
+
+            with open(self.broken, 'w') as out:
+                out.write(self.xml)
+
+            dump(self.files, resumed, False, True, jobs, fmt, resume=True)
+            dump(self.files, clean, False, True, jobs, fmt)
+            self.assertEqual(sorted(listdir(clean)), sorted(listdir(resumed)))
+
+            for name in listdir(clean):
+                with open(join(clean, name), 'rb') as a, open(join(resumed, name), 'rb') as b:
+                    self.assertEqual(a.read(), b.read(), name)
+
+    def testResume(self):
+        self.assertResumes(1)
+
+    def testResumeBinary(self):
+        self.assertResumes(1, 'pgbinary')
+
+    def testResumeParallel(self):
+        self.assertResumes(2)
+
+    def testResumeWithOtherFiles(self):
+        with TemporaryDirectory() as output:
+            self.assertRaises(Exception, dump, self.files, output, False, True)
+            self.assertRaises(ValueError, dump, self.files[1:], output, False, True, resume=True)
+
+    def testResumeWithoutCheckpoint(self):
+        with TemporaryDirectory() as output:
+            dump([self.MEDLINE_STRUCTURE_FILE], output, False, True, resume=True)
+            self.assertNotIn(CHECKPOINT_FILE, listdir(output))
+            self.assertIn(DELETE_FILE, listdir(output))
+
+
+class TestCompactDump(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.files = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def addUpdate(self, citations, deletions=()):
+        "Write an update file with the (pmid, title) *citations* and *deletions*."
+        name = join(self.dir.name, 'update{}.xml'.format(len(self.files)))
+
+        with open(name, 'w') as out:
+            out.write('<MedlineCitationSet>\n')
+
+            for pmid, title in citations:
+                citation = SyntheticMedline.CITATION.format(pmid)
+                out.write(citation.replace('>Title<', '>{}<'.format(title)))
+
+            if deletions:
+                out.write('<DeleteCitation>{}</DeleteCitation>\n'.format(
+                    ''.join('<PMID Version="1">{}</PMID>'.format(p) for p in deletions)
+                ))
+
+            out.write('</MedlineCitationSet>\n')
+
+        self.files.append(name)
+
+    def compact(self):
+        "Return the dumped titles by PMID and the PMIDs in the delete file."
+        output = join(self.dir.name, 'out')
+        mkdir(output)
+        dump(self.files, output, False, True, compact=True)
+
+        with open(join(output, 'sections.tab')) as sections, \
+                open(join(output, 'delete.txt')) as deletions:
+            titles = {}
+
+            for line in sections:
+                pmid, _, _, _, title = line.rstrip('\n').split('\t')
+                self.assertNotIn(int(pmid), titles)
+                titles[int(pmid)] = title
+
+            return titles, [int(line) for line in deletions]
+
+    def testLastVersionWins(self):
+        self.addUpdate([(1, 'old'), (2, 'two')])
+        self.addUpdate([(1, 'new'), (3, 'three')])
+        titles, deletions = self.compact()
+        self.assertEqual({1: 'new', 2: 'two', 3: 'three'}, titles)
+        self.assertEqual([1, 2, 3], deletions)
+
+    def testRepeatedInOneFile(self):
+        self.addUpdate([(1, 'old'), (1, 'new')])
+        titles, deletions = self.compact()
+        self.assertEqual({1: 'new'}, titles)
+        self.assertEqual([1], deletions)
+
+    def testLaterDeletion(self):
+        self.addUpdate([(1, 'one'), (2, 'two')])
+        self.addUpdate([], [1])
+        titles, deletions = self.compact()
+        self.assertEqual({2: 'two'}, titles)
+        self.assertEqual([1, 2], deletions)
+
+    def testDeletionInSameFile(self):
+        self.addUpdate([(1, 'one'), (2, 'two')], [2, 4])
+        titles, deletions = self.compact()
+        self.assertEqual({1: 'one'}, titles)
+        self.assertEqual([1, 2, 4], deletions)
+
+    def testReinsertedAfterDeletion(self):
+        self.addUpdate([], [1])
+        self.addUpdate([(1, 'back')])
+        titles, deletions = self.compact()
+        self.assertEqual({1: 'back'}, titles)
+        self.assertEqual([1], deletions)
+
+
+def PubmedArticleSet(pmids) -> BytesIO:
+    "A PubMed XML stream of minimal citations for the *pmids*."
+    return BytesIO('<PubmedArticleSet>\n{}</PubmedArticleSet>\n'.format(''.join(
+        '<PubmedArticle>{}</PubmedArticle>\n'.format(SyntheticMedline.CITATION.format(pmid))
+        for pmid in pmids
+    )).encode())
+
+
+class DatabaseMixin:
+    MEDLINE_STRUCTURE_FILE = join(dirname(__file__), 'medline.xml')
+
+    def setUp(self):
+        InitDb('sqlite+pysqlite://', module=dbapi2)
+        self.sess = Session()
+        self.synthetic = NamedTemporaryFile(suffix='.xml')
+        copyfileobj(SyntheticMedline(1000), self.synthetic)
+        self.synthetic.flush()
+
+    def tearDown(self):
+        self.synthetic.close()
+
+    def count(self, klass):
+        return self.sess.query(klass).count()
+
+    def fixture(self, *replacements):
+        "Return a temporary copy of the structure file with (bytes) *replacements*."
+        with open(self.MEDLINE_STRUCTURE_FILE, 'rb') as stream:
+            xml = stream.read()
+
+        for old, new in replacements:
+            xml = xml.replace(old, new)
+
+        tmp = NamedTemporaryFile(suffix='.xml')
+        tmp.write(xml)
+        tmp.flush()
+        return tmp
+
+
+class TestLoad(DatabaseMixin, unittest.TestCase):
+
+    def testLoad(self):
+        self.assertTrue(load(self.sess, [self.synthetic.name], True, False, 300))
+        self.assertEqual(1000, self.count(Medline))
+        self.assertEqual(1000, self.count(Section))
+        self.assertEqual(date.today(), self.sess.query(Medline).get(1).modified)
+
+    def testLoadDuplicates(self):
+        self.assertFalse(load(self.sess, [self.synthetic.name] * 2, True, False))
+        self.assertEqual(1000, self.count(Medline))
+
+    def testLoadUpdates(self):
+        files = [self.synthetic.name, self.MEDLINE_STRUCTURE_FILE]
+        self.assertTrue(load(self.sess, files, False, True, 100))
+        self.assertEqual(998, self.count(Medline))
+        self.assertEqual(998, self.count(Section))
+        self.assertEqual(0, self.count(Author))
+        self.assertIsNone(self.sess.query(Medline).get(123))
+
+    def testLoadAllTables(self):
+        # load without the deletions by replacing the DeleteCitation element
+        with self.fixture((b'DeleteCitation', b'Ignored')) as tmp:
+            self.assertTrue(load(self.sess, [tmp.name], False, False))
+
+        for klass in (Medline, Section, Descriptor, Qualifier, Author, Identifier, Database,
+                      PublicationType, Chemical, Keyword):
+            self.assertTrue(self.count(klass), klass.__tablename__)
+
+    def testLoadTables(self):
+        with self.fixture((b'DeleteCitation', b'Ignored')) as tmp:
+            self.assertTrue(load(self.sess, [tmp.name], False, False, tables=['descriptors']))
+
+        for klass in (Medline, Descriptor):
+            self.assertTrue(self.count(klass), klass.__tablename__)
+
+        for klass in (Section, Qualifier, Author, Identifier, Database, PublicationType,
+                      Chemical, Keyword):
+            self.assertEqual(0, self.count(klass), klass.__tablename__)
+
+
+class TestInsert(DatabaseMixin, unittest.TestCase):
+
+    def testInsert(self):
+        self.assertTrue(insert(self.sess, [self.synthetic.name], True, 300))
+        self.assertEqual(1000, self.count(Medline))
+        self.assertEqual(1000, self.count(Section))
+
+    def testInsertTables(self):
+        with self.fixture((b'DeleteCitation', b'Ignored')) as tmp:
+            self.assertTrue(insert(self.sess, [tmp.name], False, tables=['authors']))
+
+        self.assertTrue(self.count(Author))
+        self.assertEqual(0, self.count(Section))
+
+    def testCommitsEachBatch(self):
+        self.assertFalse(insert(self.sess, [self.synthetic.name] * 2, True, 300))
+        self.assertEqual(900, self.count(Medline))  # the first three batches
+
+    def testResume(self):
+        today = date.today()
+        self.sess.execute(Medline.__table__.insert(), dict(
+            pmid=650, status='MEDLINE', journal='Journal', pub_date='2000',
+            created=today, modified=today
+        ))
+        self.sess.commit()
+
+        with self.assertLogs('medic.crud', 'ERROR') as log:
+            self.assertFalse(insert(self.sess, [self.synthetic.name], True, 100, 250))
+
+        self.assertIn('use --resume 500 to continue', log.output[-1])
+        self.assertEqual(501, self.count(Medline))
+        self.sess.query(Medline).filter(Medline.pmid == 650).delete()
+        self.sess.commit()
+        self.assertTrue(insert(self.sess, [self.synthetic.name], True, 100, 250, 500))
+        self.assertEqual(1000, self.count(Medline))
+        self.assertEqual(1000, self.count(Section))
+
+    def testDownload(self):
+        def download(pmids, failed=None):
+            yield PubmedArticleSet(pmids[:150])
+            failed.extend(pmids[150:])
+
+        with patch('medic.crud.CachedDownloadAll', download), \
+                self.assertLogs('medic.crud', 'ERROR') as log:
+            self.assertFalse(insert(self.sess, list(range(1, 153)), True))
+
+        self.assertEqual(150, self.count(Medline))
+        self.assertIn('failed to download 2 PMIDs: 151 152', log.output[-1])
+
+    def testDownloadCommitsEachBatch(self):
+        def download(pmids, failed=None):
+            yield PubmedArticleSet(pmids[:100])
+            raise URLError('unreachable')
+
+        with patch('medic.crud.CachedDownloadAll', download), self.assertRaises(URLError):
+            insert(self.sess, list(range(1, 201)), True)
+
+        self.sess.rollback()
+        self.assertEqual(100, self.count(Medline))
+
+    def testResumeSkipsDeletions(self):
+        self.assertTrue(insert(self.sess, [self.synthetic.name], True))
+        files = [self.MEDLINE_STRUCTURE_FILE, self.synthetic.name]
+        # the structure file has one citation (with VersionID 1)
+        self.assertTrue(insert(self.sess, files, True, resume=1001))
+        self.assertEqual(1000, self.count(Medline))
+        self.assertIsNotNone(self.sess.query(Medline).get(123))
+
+    def testInsertDeletions(self):
+        # the deletions are applied after the citations were inserted
+        self.assertTrue(insert(self.sess, [self.MEDLINE_STRUCTURE_FILE], False))
+        self.assertEqual(0, self.count(Medline))
+        self.assertEqual(0, self.count(Author))
+
+
+class TestUpdate(DatabaseMixin, unittest.TestCase):
+    NO_DELETION = (b'DeleteCitation', b'Ignored')
+
+    def testUpdateInserts(self):
+        self.assertTrue(update(self.sess, [self.synthetic.name] * 2, True, 300))
+        self.assertEqual(1000, self.count(Medline))
+        self.assertEqual(1000, self.count(Section))
+
+    def testUpdateReplaces(self):
+        with self.fixture(self.NO_DELETION) as tmp:
+            self.assertTrue(insert(self.sess, [tmp.name], False))
+
+        counts = {klass: self.count(klass) for klass in (Section, Descriptor, Qualifier, Author)}
+        revised = self.fixture(
+            self.NO_DELETION,
+            (b'[a translated title].', b'A revised title.'),
+            (b'<LastName>Middle</LastName>', b'<LastName>Center</LastName>'),
+        )
+
+        with revised as tmp:
+            self.assertTrue(update(self.sess, [tmp.name], False, 1))
+
+        record = self.sess.query(Medline).get(123)
+        self.assertEqual(['Author', 'Center', 'Author'], [a.name for a in record.authors])
+        self.assertEqual('A revised title.',
+                         [s.content for s in record.sections if s.name == 'Title'][0])
+
+        for klass, count in counts.items():
+            self.assertEqual(count, self.count(klass), klass.__tablename__)
+
+        self.assertEqual(2, self.count(Medline))
+
+    def testSkipsUnchanged(self):
+        with self.fixture(self.NO_DELETION) as tmp:
+            self.assertTrue(insert(self.sess, [tmp.name], False))
+            self.sess.query(Medline).update({'modified': date(2000, 1, 1)})
+            self.sess.commit()
+
+            with self.assertLogs('medic.crud', 'INFO') as log:
+                self.assertTrue(update(self.sess, [tmp.name], False))
+
+        self.assertIn('skipped 2 unchanged and rewrote 0 citations', log.output[-1])
+        self.assertEqual([date(2000, 1, 1)] * 2,
+                         [r.modified for r in self.sess.query(Medline)])
+
+    def testRewritesChanged(self):
+        with self.fixture(self.NO_DELETION) as tmp:
+            self.assertTrue(insert(self.sess, [tmp.name], False))
+
+        with self.fixture(self.NO_DELETION, (b'Middle', b'Center')) as tmp:
+            with self.assertLogs('medic.crud', 'INFO') as log:
+                self.assertTrue(update(self.sess, [tmp.name], False))
+
+        self.assertIn('skipped 1 unchanged and rewrote 1 citations', log.output[-1])
+        self.assertIn('Center', [a.name for a in self.sess.query(Medline).get(123).authors])
+
+    def testUpdateDeletions(self):
+        self.assertTrue(update(self.sess, [self.MEDLINE_STRUCTURE_FILE] * 2, False))
+        self.assertEqual(0, self.count(Medline))
+        self.assertEqual(0, self.count(Section))
+
+
+class TestApply(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestApply, self).setUp()
+        self.tmp = TemporaryDirectory()
+        self.baseline = self.copy(self.synthetic.name, 'medline14n0009.xml')
+        self.update = self.copy(self.MEDLINE_STRUCTURE_FILE, 'medline14n0010.xml')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super(TestApply, self).tearDown()
+
+    def copy(self, source, name):
+        path = join(self.tmp.name, name)
+
+        with open(source, 'rb') as src, open(path, 'wb') as dst:
+            copyfileobj(src, dst)
+
+        return path
+
+    def testApply(self):
+        self.assertTrue(apply(self.sess, [self.update, self.baseline], False))
+        self.assertEqual(998, self.count(Medline))
+        self.assertIsNone(self.sess.query(Medline).get(123))
+        manifest = self.sess.query(Manifest).order_by(Manifest.name).all()
+        self.assertEqual(['medline14n0009.xml', 'medline14n0010.xml'], [m.name for m in manifest])
+        self.assertEqual([1000, 2], [m.records for m in manifest])
+        self.assertEqual(32, len(manifest[0].checksum))
+
+    def testSkipsAppliedFiles(self):
+        self.assertTrue(apply(self.sess, [self.baseline], False))
+        self.sess.query(Medline).filter(Medline.pmid == 1).delete()
+        self.sess.commit()
+        self.assertTrue(apply(self.sess, [self.baseline, self.update], False))
+        self.assertIsNone(self.sess.query(Medline).get(1))
+        self.assertEqual(2, self.count(Manifest))
+
+    def testChangedAppliedFile(self):
+        self.assertTrue(apply(self.sess, [self.baseline], False))
+        self.copy(self.MEDLINE_STRUCTURE_FILE, 'medline14n0009.xml')
+
+        with self.assertLogs('medic.crud', 'ERROR') as log:
+            self.assertFalse(apply(self.sess, [self.baseline, self.update], False))
+
+        self.assertIn('medline14n0009.xml has changed since it was applied', log.output[0])
+        self.assertEqual(1, self.count(Manifest))
+
+    def testSequence(self):
+        self.assertTrue(apply(self.sess, [self.update], False))
+
+        with self.assertLogs('medic.crud', 'ERROR') as log:
+            self.assertFalse(apply(self.sess, [self.baseline, self.update], False))
+
+        self.assertIn('medline14n0009.xml precedes the last applied file medline14n0010.xml',
+                      log.output[0])
+        self.assertEqual(1, self.count(Manifest))
+
+    def testNumericOrder(self):
+        later = self.copy(self.MEDLINE_STRUCTURE_FILE, 'medline14n10000.xml')
+        self.assertTrue(apply(self.sess, [later, self.baseline], False))
+        self.assertIsNone(self.sess.query(Medline).get(123))
+
+    def testFailedFileIsRolledBack(self):
+        broken = join(self.tmp.name, 'medline14n0010.xml')
+
+        with open(self.MEDLINE_STRUCTURE_FILE, 'rb') as stream:
+            xml = stream.read()
+
+        with open(broken, 'wb') as stream:
+            stream.write(xml[:len(xml) // 2])
+
+        with self.assertLogs('medic.crud', 'ERROR'):
+            self.assertFalse(apply(self.sess, [self.baseline, broken], False))
+
+        self.assertEqual(1, self.count(Manifest))
+        self.assertEqual(1000, self.count(Medline))
+        self.copy(self.MEDLINE_STRUCTURE_FILE, 'medline14n0010.xml')
+        self.assertTrue(apply(self.sess, [self.baseline, broken], False))
+        self.assertEqual(2, self.count(Manifest))
+        self.assertEqual(998, self.count(Medline))
+
+
+class TestSync(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestSync, self).setUp()
+        self.assertTrue(insert(self.sess, [self.synthetic.name], True))
+        t = Medline.__table__
+        self.sess.execute(t.update(t.c.pmid <= 10).values(modified=date(2000, 1, 1)))
+        self.sess.commit()
+        self.downloaded = []
+
+    def download(self, pmids, failed=None):
+        self.downloaded.extend(pmids)
+        yield PubmedArticleSet(pmids)
+
+    def sync(self, pmids, max_age=30):
+        with patch('medic.crud.CachedDownloadAll', self.download), \
+                self.assertLogs('medic.crud', 'INFO') as log:
+            self.assertTrue(sync(self.sess, pmids, True, max_age))
+
+        return log.output
+
+    def testSync(self):
+        log = self.sync(list(range(1, 1006)))
+        self.assertEqual(list(range(1, 11)) + list(range(1001, 1006)), self.downloaded)
+        self.assertEqual(1005, self.count(Medline))
+        self.assertIn('avoided downloading 990 PMIDs and rewriting 10 unchanged citations',
+                      log[-1])
+        self.assertEqual(0, len(Medline.modifiedBefore(range(1, 1006), date.today())))
+
+    def testSyncIsIncremental(self):
+        self.sync(list(range(1, 1006)))
+        self.downloaded = []
+        log = self.sync(list(range(1, 1006)))
+        self.assertEqual([], self.downloaded)
+        self.assertIn('avoided downloading 1005 PMIDs', log[-1])
+
+    def testMaxAge(self):
+        self.sync([1, 11, 12], max_age=0)
+        self.assertEqual([1], self.downloaded)
+
+    def testDuplicates(self):
+        self.sync([1, 1, 2])
+        self.assertEqual([1, 2], self.downloaded)
+
+
+class TestSelectDelete(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestSelectDelete, self).setUp()
+        insert(self.sess, [self.synthetic.name], True)
+
+    def testSelectMany(self):
+        pmids = range(400, 2000)
+        self.assertEqual(list(range(400, 1001)), sorted(r.pmid for r in select(self.sess, pmids)))
+
+    def testDeleteMany(self):
+        self.assertTrue(delete(self.sess, range(1, 2000, 2)))
+        self.assertEqual(500, self.count(Medline))
+        self.assertEqual(500, self.count(Section))
+        self.assertEqual(2, len(list(select(self.sess, [1, 2, 3, 4]))))
+
+
+class TestEagerSelect(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestEagerSelect, self).setUp()
+
+        structure = self.fixture(
+            (b'DeleteCitation', b'Ignored'), (b'>123<', b'>2123<'), (b'>987<', b'>2987<')
+        )
+
+        with structure as tmp:
+            insert(self.sess, [self.synthetic.name, tmp.name], False)
+
+        self.statements = 0
+        event.listen(self.sess.bind, 'before_cursor_execute', self.countStatement)
+
+    def countStatement(self, *_):
+        self.statements += 1
+
+    def touch(self, records):
+        "Access all relations of the *records* (like the writers do)."
+        content = []
+
+        for rec in records:
+            content.append((rec.pmid, [s.content for s in rec.sections]))
+
+            for relation in RELATIONS:
+                content.append(len(getattr(rec, relation)))
+
+            for desc in rec.descriptors:
+                content.append([q.name for q in desc.qualifiers])
+
+        return content
+
+    def testConstantStatementsPerBlock(self):
+        pmids = list(range(1, 1001)) + [2123, 2987]
+        content = self.touch(select(self.sess, pmids, RELATIONS, 200))
+        # per block (of 6): the records, each relation, and the descriptors' qualifiers
+        self.assertLessEqual(self.statements, 6 * (len(RELATIONS) + 2))
+        self.sess.expunge_all()
+        self.assertEqual(content, self.touch(select(self.sess, pmids)))
+        self.assertGreater(self.statements, 1002 * len(RELATIONS))
+
+    def testStreaming(self):
+        pmids = list(range(1, 1001)) + [2123, 2987]
+        self.sess.expunge_all()
+        sizes = []
+        records = []
+
+        for rec in select(self.sess, pmids, RELATIONS, 100, stream=True):
+            sizes.append(len(self.sess.identity_map))
+            records.append(rec.pmid)
+
+        self.assertEqual(sorted(pmids), records)
+        self.assertLessEqual(max(sizes), 200)  # at most a page of records and sections
+        self.assertEqual(0, len(self.sess.identity_map))
+
+    def testStreamingLazy(self):
+        records = [rec.pmid for rec in select(self.sess, range(3, 1000, 3), block_size=7,
+                                               stream=True)]
+        self.assertEqual(list(range(3, 1000, 3)), records)
+
+    def testUnknownRelation(self):
+        self.assertRaises(ValueError, list, select(self.sess, [1], ['unknown']))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,16 @@
 from collections import namedtuple
-from datetime import timedelta, date
+from datetime import timedelta, date, datetime
 from sqlite3 import dbapi2
 from sqlalchemy.engine.url import URL
 from unittest import main, TestCase
+from unittest.mock import patch
 
-from sqlalchemy.exc import IntegrityError, StatementError
+from sqlalchemy.exc import IntegrityError, OperationalError, StatementError
+from sqlalchemy.schema import Table
 
 from medic.orm import InitDb, Session, Medline, Section, Author, Descriptor, Qualifier, \
-        Database, Identifier, Chemical, Keyword, PublicationType
+        Database, Identifier, Chemical, Keyword, PublicationType, Manifest, PmidFilter, \
+        BULK_KEY_LIMIT
 
 __author__ = 'Florian Leitner'
 
@@ -171,7 +174,7 @@ class MedlineTest(TestCase, TestMixin):
     def testToString(self):
         d = date.today()
         r = Medline(1, 'MEDLINE', 'journal\\.', 'PubDate', d)
-        line = "1\tMEDLINE\tjournal\\.\tPubDate\t\\N\t\\N\t{}\t\\N\t\\N\t{}\n".format(
+        line = "1\tMEDLINE\tjournal\\.\tPubDate\t\\N\t\\N\t{}\t\\N\t\\N\t{}\t\\N\n".format(
                 d.isoformat(), d.isoformat()
         )
         self.assertEqual(line, str(r))
@@ -275,6 +278,88 @@ class MedlineTest(TestCase, TestMixin):
         self.addThree(date.today())
         self.assertListEqual([1, 3], list(Medline.existing([1, 3, 5])))
 
+    # BULK PMID LISTS (beyond BULK_KEY_LIMIT)
+
+    def addMany(self, n, modified=date.today()):
+        Medline.insert({
+            Medline.__tablename__: [dict(
+                pmid=pmid, status='MEDLINE', journal='Journal {}'.format(pmid),
+                pub_date='PubDate', created=date.today(), modified=modified
+            ) for pmid in range(1, n + 1)],
+            Identifier.__tablename__: [
+                dict(pmid=pmid, namespace='doi', value='id{}'.format(pmid))
+                for pmid in range(1, n + 1)
+            ],
+        })
+
+    def testBulkExisting(self):
+        self.addMany(BULK_KEY_LIMIT + 100)
+        pmids = list(range(BULK_KEY_LIMIT // 2, BULK_KEY_LIMIT * 2))
+        existing = set(range(BULK_KEY_LIMIT // 2, BULK_KEY_LIMIT + 101))
+        self.assertSetEqual(existing, Medline.existing(pmids))
+        self.assertSetEqual(set(pmids) - existing, Medline.missing(pmids))
+
+    def testBulkModifiedBefore(self):
+        self.addMany(BULK_KEY_LIMIT * 2, date(2000, 1, 1))
+        pmids = range(1, BULK_KEY_LIMIT * 3)
+        self.assertEqual(BULK_KEY_LIMIT * 2, len(Medline.modifiedBefore(pmids, date.today())))
+        self.assertEqual(0, len(Medline.modifiedBefore(pmids, date(2000, 1, 1))))
+
+    def testBulkSelect(self):
+        self.addMany(BULK_KEY_LIMIT * 2)
+        pmids = range(2, BULK_KEY_LIMIT * 3, 2)
+        rows = Medline.select(pmids, ['journal'])
+        self.assertEqual(BULK_KEY_LIMIT, len(rows))
+
+        for row in rows:
+            self.assertEqual('Journal {}'.format(row['pmid']), row['journal'])
+
+        self.assertEqual(BULK_KEY_LIMIT, len(Medline.selectAll(pmids)))
+
+    def testBulkDelete(self):
+        self.addMany(BULK_KEY_LIMIT * 2)
+        Medline.delete(range(1, BULK_KEY_LIMIT * 2, 2))
+        self.assertEqual(BULK_KEY_LIMIT, self.sess.query(Medline).count())
+        self.assertEqual(BULK_KEY_LIMIT, self.sess.query(Identifier).count())
+        # the temporary key table is gone
+        self.assertEqual(BULK_KEY_LIMIT, len(Medline.existing(range(BULK_KEY_LIMIT * 2 + 1))))
+
+    def testBulkMapPmids2Dois(self):
+        self.addMany(BULK_KEY_LIMIT * 2)
+        mapping = Identifier.mapPmids2Dois(range(BULK_KEY_LIMIT, BULK_KEY_LIMIT * 3))
+        self.assertEqual(BULK_KEY_LIMIT + 1, len(mapping))
+        self.assertEqual('id{}'.format(BULK_KEY_LIMIT), mapping[BULK_KEY_LIMIT])
+
+
+class PmidFilterTest(TestCase):
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+        self.sess.execute(Medline.__table__.insert(), [dict(
+            pmid=pmid, status='MEDLINE', journal='Journal', pub_date='PubDate',
+            created=date.today(), modified=date.today()
+        ) for pmid in range(1, BULK_KEY_LIMIT * 3)])
+
+    def count(self, clause) -> int:
+        return self.sess.query(Medline).filter(clause).count()
+
+    def testNested(self):
+        conn = self.sess.connection()
+
+        with PmidFilter(conn, Medline.pmid, range(1, BULK_KEY_LIMIT * 2)) as outer:
+            with PmidFilter(conn, Medline.pmid, range(BULK_KEY_LIMIT, BULK_KEY_LIMIT * 3)) as inner:
+                self.assertEqual(BULK_KEY_LIMIT, self.count(outer & inner))
+
+            self.assertEqual(BULK_KEY_LIMIT * 2 - 1, self.count(outer))
+
+    def testFailedDropDoesNotMaskError(self):
+        conn = self.sess.connection()
+        error = OperationalError('DROP TABLE', None, Exception('aborted transaction'))
+
+        with self.assertRaises(KeyError), patch.object(Table, 'drop', side_effect=error):
+            with PmidFilter(conn, Medline.pmid, range(1, BULK_KEY_LIMIT * 2)):
+                raise KeyError('in the block')
+
 
 class SectionTest(TestCase, TestMixin):
     def setUp(self):
@@ -988,5 +1073,31 @@ class KeywordTest(TestCase, TestMixin):
         self.assertEqual(self.M, i.medline)
 
 
+class ManifestTest(TestCase):
+    def setUp(self):
+        InitDb(URI, module=dbapi2)
+        self.sess = Session()
+
+    def testCreate(self):
+        applied = datetime(2014, 1, 2, 3, 4, 5)
+        self.sess.add(Manifest('medline14n0001.xml.gz', '0f' * 16, 30000, applied, 1.5))
+        self.sess.commit()
+        m = self.sess.query(Manifest).get('medline14n0001.xml.gz')
+        self.assertEqual(('0f' * 16, 30000, applied, 1.5),
+                         (m.checksum, m.records, m.applied, m.seconds))
+
+    def testRequireName(self):
+        self.assertRaises(AssertionError, Manifest, '', 'x', 0, datetime.now(), 0.0)
+
+    def testUniqueName(self):
+        self.sess.add(Manifest('a.xml', 'x', 0, datetime.now(), 0.0))
+        self.sess.commit()
+        self.sess.add(Manifest('a.xml', 'y', 0, datetime.now(), 0.0))
+        self.assertRaises(IntegrityError, self.sess.commit)
+
+    def testToRepr(self):
+        self.assertEqual('Manifest<a.xml>', repr(Manifest('a.xml', 'x', 0, datetime.now(), 0.0)))
+
+
 if __name__ == '__main__':
     main()
@@ -1,11 +1,15 @@
+import tracemalloc
+
+from io import RawIOBase
 from sqlite3 import dbapi2
 from os.path import dirname
-from unittest import main, TestCase
+from unittest import main, skipIf, TestCase
 from sqlalchemy.engine.url import URL
 from datetime import date
 
 from medic import orm
-from medic.parser import MedlineXMLParser, PubMedXMLParser
+from medic.parser import MedlineXMLParser, PubMedXMLParser, ElementTreeEngine, LxmlEngine, \
+        Projection, lxml_etree
 
 __author__ = 'Florian Leitner'
 
@@ -114,5 +118,143 @@ class ParserTest(TestCase):
         self.assertEqual(len(items) - 1, i - 2, repr(item))
 
 
+class ProjectionTest(TestCase):
+
+    def parse(self, tables):
+        with open(ParserTest.MEDLINE_STRUCTURE_FILE, 'rb') as stream:
+            return list(MedlineXMLParser(False, tables=tables).parse(stream))
+
+    def testSelectedTables(self):
+        everything = self.parse(None)
+        projected = self.parse(['sections', 'descriptors'])
+        tables = {'records', 'sections', 'descriptors'}
+        expected = [i for i in everything if type(i) == int or i.__tablename__ in tables]
+        self.assertEqual(expected, projected)
+        self.assertNotEqual(everything, projected)
+
+    def testUnselectedHandlersAreNotDispatched(self):
+        parser = MedlineXMLParser(tables=['descriptors'])
+        self.assertIn('MeshHeadingList', parser.tags)
+        self.assertIn('PMID', parser.tags)
+        self.assertIn('DeleteCitation', parser.tags)
+
+        for tag in ('AuthorList', 'Abstract', 'ChemicalList', 'KeywordList', 'OtherID'):
+            self.assertNotIn(tag, parser.tags)
+
+        self.assertNotIn('ArticleId', PubMedXMLParser(tables=['sections']).tags)
+
+    def testProjection(self):
+        self.assertEqual({'records'}, Projection([]))
+        self.assertEqual({'records', 'descriptors', 'qualifiers'},
+                         Projection(['descriptors', 'qualifiers']))
+        self.assertRaises(ValueError, Projection, ['qualifiers'])
+        self.assertRaises(ValueError, Projection, ['abstracts'])
+
+
+class EngineTest(TestCase):
+
+    def parseWith(self, klass, engine, unique):
+        with open(ParserTest.MEDLINE_STRUCTURE_FILE, 'rb') as stream:
+            return list(klass(unique, engine).parse(stream))
+
+    def assertSameInstances(self, klass, unique):
+        expected = self.parseWith(klass, ElementTreeEngine.name, unique)
+        result = self.parseWith(klass, LxmlEngine.name, unique)
+        self.assertEqual(len(expected), len(result))
+
+        for e, r in zip(expected, result):
+            self.assertEqual(str(e), str(r))
+            self.assertEqual(e, r)
+
+    def testTagsIncludeSubclassHandlers(self):
+        tags = PubMedXMLParser.handledTags()
+
+        for tag in ('PMID', 'DeleteCitation', 'MedlineCitation', 'AuthorList', 'ArticleId'):
+            self.assertIn(tag, tags)
+
+        self.assertNotIn('ArticleId', MedlineXMLParser.handledTags())
+        self.assertNotIn('parseAuthor', tags)
+
+    @skipIf(lxml_etree is None, 'lxml not installed')
+    def testMedlineEngines(self):
+        self.assertSameInstances(MedlineXMLParser, True)
+        self.assertSameInstances(MedlineXMLParser, False)
+
+    @skipIf(lxml_etree is None, 'lxml not installed')
+    def testPubMedEngines(self):
+        self.assertSameInstances(PubMedXMLParser, True)
+        self.assertSameInstances(PubMedXMLParser, False)
+
+    @skipIf(lxml_etree is None, 'lxml not installed')
+    def testTextStream(self):
+        with open(ParserTest.MEDLINE_STRUCTURE_FILE) as stream:
+            result = list(MedlineXMLParser(False, LxmlEngine.name).parse(stream))
+
+        self.assertEqual(self.parseWith(MedlineXMLParser, ElementTreeEngine.name, False), result)
+
+
+class SyntheticMedline(RawIOBase):
+    "A MEDLINE XML stream of *size* minimal citations, generated on the fly."
+
+    CITATION = (
+        '<MedlineCitation Status="MEDLINE"><PMID>{}</PMID>'
+        '<DateCreated><Year>2000</Year></DateCreated>'
+        '<Article><Journal><JournalIssue><PubDate><Year>2000</Year></PubDate>'
+        '</JournalIssue></Journal><ArticleTitle>Title</ArticleTitle></Article>'
+        '<MedlineJournalInfo><MedlineTA>Journal</MedlineTA></MedlineJournalInfo>'
+        '</MedlineCitation>\n'
+    )
+
+    def __init__(self, size):
+        self.chunks = self.generate(size)
+        self.buffer = b''
+
+    def generate(self, size):
+        yield b'<MedlineCitationSet>\n'
+
+        for pmid in range(1, size + 1):
+            yield SyntheticMedline.CITATION.format(pmid).encode()
+
+        yield b'</MedlineCitationSet>\n'
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        for chunk in self.chunks:
+            self.buffer += chunk
+
+            if len(self.buffer) >= len(buffer):
+                break
+
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+class StreamingTest(TestCase):
+
+    def peakMemory(self, size):
+        tracemalloc.start()
+
+        try:
+            count = 0
+
+            for _ in MedlineXMLParser(True, ElementTreeEngine.name).parse(SyntheticMedline(size)):
+                count += 1
+
+            self.assertEqual(2 * size, count)  # a Medline and a Section instance per citation
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def testConstantMemory(self):
+        # lxml allocates its tree outside Python's allocator (i.e., invisible to tracemalloc)
+        small = self.peakMemory(1000)
+        large = self.peakMemory(100000)
+        self.assertLess(large, 2 * small, (small, large))
+
+
 if __name__ == '__main__':
     main()
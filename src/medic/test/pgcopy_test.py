@@ -0,0 +1,166 @@
+from datetime import date, timedelta
+from os import listdir
+from os.path import dirname, join
+from struct import unpack_from
+from tempfile import TemporaryDirectory
+from unittest import main, TestCase
+
+from sqlalchemy.types import BigInteger, Boolean, Date, SmallInteger
+
+from medic import orm, rows
+from medic.crud import dump, DUMP_TABLES
+from medic.orm import NULL, STRING
+from medic.pgcopy import Concatenate, Encode, Writer, HEADER, TRAILER, ENCODERS
+
+__author__ = 'Florian Leitner'
+
+MEDLINE_STRUCTURE_FILE = join(dirname(__file__), 'medline.xml')
+TABLES = {klass.__tablename__: klass.__table__ for klass in DUMP_TABLES}
+
+
+def Decode(data: bytes, table) -> list:
+    "Decode the tuples of a binary COPY file's *data* for a *table* (with header)."
+    assert data.startswith(HEADER)
+    assert data.endswith(TRAILER)
+    offset = len(HEADER)
+    tuples = []
+
+    while True:
+        count = unpack_from('!h', data, offset)[0]
+        offset += 2
+
+        if count == -1:
+            break
+
+        assert count == len(table.columns), count
+        values = []
+
+        for col in table.columns:
+            length = unpack_from('!i', data, offset)[0]
+            offset += 4
+
+            if length == -1:
+                values.append(None)
+                continue
+
+            field = data[offset:offset + length]
+            offset += length
+
+            if isinstance(col.type, Boolean):
+                values.append(field == b'\x01')
+            elif isinstance(col.type, SmallInteger):
+                values.append(unpack_from('!h', field)[0])
+            elif isinstance(col.type, BigInteger):
+                values.append(unpack_from('!q', field)[0])
+            elif isinstance(col.type, Date):
+                values.append(date(2000, 1, 1) + timedelta(days=unpack_from('!i', field)[0]))
+            else:
+                values.append(field.decode('utf-8'))
+
+        tuples.append(values)
+
+    assert offset == len(data), (offset, len(data))
+    return tuples
+
+
+def AsTab(values: list) -> str:
+    "Format decoded tuple *values* like the text COPY format."
+    def fmt(value):
+        if isinstance(value, bool):
+            return 'T' if value else 'F'
+        elif isinstance(value, date):
+            return value.isoformat()
+        elif isinstance(value, str):
+            return STRING(value)
+        else:
+            return str(NULL(value))
+
+    return '\t'.join(map(fmt, values)) + '\n'
+
+
+class EncodeTest(TestCase):
+
+    def testSection(self):
+        data = Encode(rows.Section(1, 2, 'Title', 'Text', None))
+        self.assertEqual(
+            b'\x00\x05' +
+            b'\x00\x00\x00\x08' + b'\x00\x00\x00\x00\x00\x00\x00\x01' +
+            b'\x00\x00\x00\x02' + b'\x00\x02' +
+            b'\x00\x00\x00\x05' + b'Title' +
+            b'\xff\xff\xff\xff' +
+            b'\x00\x00\x00\x04' + b'Text', data
+        )
+
+    def testMedline(self):
+        instance = orm.Medline(1, 'MEDLINE', 'Jé', 'date', date(2000, 1, 3), digest='0f')
+        values = Decode(HEADER + Encode(instance) + TRAILER, orm.Medline.__table__)[0]
+        self.assertEqual([1, 'MEDLINE', 'Jé', 'date', None, None, date(2000, 1, 3),
+                          None, None, date.today(), '0f'], values)
+
+    def testRowsAndOrm(self):
+        self.assertEqual(Encode(orm.Descriptor(1, 2, 'name', True)),
+                         Encode(rows.Descriptor(1, 2, 'name', True)))
+
+    def testAllTables(self):
+        self.assertEqual(set(TABLES), set(ENCODERS))
+
+
+class WriterTest(TestCase):
+
+    def testEmptyFile(self):
+        with TemporaryDirectory() as tmp:
+            writer = Writer(join(tmp, 'empty.bin'))
+            writer.close()
+
+            with open(join(tmp, 'empty.bin'), 'rb') as stream:
+                self.assertEqual(b'', stream.read())
+
+    def testConcatenate(self):
+        one = Encode(rows.PublicationType(1, 'one'))
+        two = Encode(rows.PublicationType(2, 'two'))
+
+        with TemporaryDirectory() as tmp:
+            paths = [join(tmp, name) for name in ('a', 'b', 'c')]
+
+            for path, data in zip(paths, ([one], [], [two, one])):
+                writer = Writer(path)
+
+                for d in data:
+                    writer.write(d)
+
+                writer.close()
+
+            Concatenate(paths, join(tmp, 'all'))
+
+            with open(join(tmp, 'all'), 'rb') as stream:
+                self.assertEqual(HEADER + one + two + one + TRAILER, stream.read())
+
+
+class DumpTest(TestCase):
+
+    def assertSameAsTab(self, files, jobs):
+        with TemporaryDirectory() as tab, TemporaryDirectory() as binary:
+            dump(files, tab, False, True)
+            dump(files, binary, False, True, jobs, 'pgbinary')
+            names = sorted(listdir(binary))
+            self.assertEqual(sorted(n.replace('.tab', '.bin') for n in listdir(tab)), names)
+
+            for name in names:
+                if name.endswith('.bin'):
+                    table = TABLES[name[:-4]]
+
+                    with open(join(binary, name), 'rb') as stream:
+                        result = [AsTab(v) for v in Decode(stream.read(), table)]
+
+                    with open(join(tab, name[:-4] + '.tab')) as stream:
+                        self.assertEqual(stream.readlines(), result, name)
+
+    def testDumpFormat(self):
+        self.assertSameAsTab([MEDLINE_STRUCTURE_FILE], 1)
+
+    def testParallelDumpFormat(self):
+        self.assertSameAsTab([MEDLINE_STRUCTURE_FILE] * 3, 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+from threading import active_count, Event
+from time import sleep, time
+from unittest import main, TestCase
+
+from medic.pipeline import Pipeline
+
+__author__ = 'Florian Leitner'
+
+
+def Slow(seconds, items):
+    for i in items:
+        sleep(seconds)
+        yield i
+
+
+def Work(seconds):
+    def work(item):
+        sleep(seconds)
+        return item * 2
+
+    return work
+
+
+class PipelineTest(TestCase):
+
+    def testItems(self):
+        pipeline = Pipeline(range(10), [('double', Work(0)), ('add', lambda i: i + 1)])
+        self.assertEqual([i * 2 + 1 for i in range(10)], list(pipeline))
+
+    def testNoStages(self):
+        self.assertEqual(list(range(100)), list(Pipeline(range(100), size=2)))
+
+    def testOverlap(self):
+        produced = Event()
+        started = Event()
+        waited = []
+
+        def source():
+            yield 0
+            produced.set()
+            yield 1
+
+        def work(item):
+            if item == 0:
+                # sequentially, the source would only be asked for 1 after this
+                waited.append(produced.wait(5))
+            else:
+                started.set()
+
+            return item
+
+        for i in Pipeline(source(), [('work', work)]):
+            if i == 0:
+                # sequentially, 1 would only be worked on after this
+                waited.append(started.wait(5))
+
+        self.assertEqual([True, True], waited)
+
+    def testSlowestStage(self):
+        start = time()
+
+        for _ in Pipeline(Slow(0.08, range(10)), [('work', Work(0.1))]):
+            sleep(0.08)
+
+        # sequentially, this would take 2.6 s, and pipelined about 1.2 s
+        self.assertLess(time() - start, 1.9)
+
+    def testMetrics(self):
+        pipeline = Pipeline(Slow(0.01, range(10)), [('work', Work(0))], 'sink', size=3)
+
+        for _ in pipeline:
+            sleep(0.05)
+
+        source, work, sink = pipeline.stages
+        self.assertEqual(['source', 'work', 'sink'], [s.name for s in pipeline.stages])
+        self.assertEqual([10, 10, 10], [s.items for s in pipeline.stages])
+        self.assertGreaterEqual(source.seconds, 0.1)
+        self.assertGreaterEqual(sink.seconds, 0.5)
+        self.assertGreater(work.throughput, sink.throughput)
+        # the slow sink keeps the queue in front of it full
+        self.assertEqual(3, work.max_depth)
+        self.assertLessEqual(source.max_depth, 3)
+
+    def testSourceError(self):
+        def source():
+            yield 1
+            raise IOError('failed')
+
+        items = []
+
+        with self.assertRaisesRegex(IOError, 'failed'):
+            for i in Pipeline(source(), [('work', Work(0))]):
+                items.append(i)
+
+        self.assertEqual([2], items)
+
+    def testStageError(self):
+        with self.assertRaises(ZeroDivisionError):
+            list(Pipeline(range(10), [('work', lambda i: 1 / (i - 5))]))
+
+    def testStop(self):
+        threads = active_count()
+        closed = []
+
+        def source():
+            try:
+                yield from range(1000)
+            finally:
+                closed.append(True)
+
+        for i in Pipeline(source(), [('work', Work(0))], size=2):
+            if i == 4:
+                break
+
+        self.assertEqual([True], closed)
+        self.assertEqual(threads, active_count())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+from datetime import date
+from os.path import dirname, join
+from unittest import main, TestCase
+
+from medic import orm, rows
+from medic.parser import MedlineXMLParser, PubMedXMLParser
+
+__author__ = 'Florian Leitner'
+
+MEDLINE_STRUCTURE_FILE = join(dirname(__file__), 'medline.xml')
+
+ARGUMENTS = [
+    ('Section', (1, 1, 'Title', 'The\tTitle')),
+    ('Section', (1, 2, 'Abstract', 'The\nAbstract', 'label')),
+    ('Descriptor', (1, 1, 'd_name', True)),
+    ('Qualifier', (1, 1, 1, 'q_name', True)),
+    ('Author', (1, 1, 'last', 'I', 'first', 'Jr')),
+    ('Identifier', (1, 'ns', 'id\\')),
+    ('Database', (1, 'name', 'accession')),
+    ('PublicationType', (1, 'some')),
+    ('Chemical', (1, 1, 'name', 'uid')),
+    ('Chemical', (1, 2, 'name')),
+    ('Keyword', (1, 'NOTNLM', 1, 'name', True)),
+    ('Medline', (1, 'MEDLINE', 'journal', 'pub_date', date(2000, 1, 2),
+                 date(2000, 3, 4), None, 'issue', 'pages')),
+]
+
+
+class RowTest(TestCase):
+
+    def testStr(self):
+        for name, args in ARGUMENTS:
+            self.assertEqual(str(getattr(orm, name)(*args)), str(getattr(rows, name)(*args)))
+
+    def testTablename(self):
+        for name in rows.__all__:
+            self.assertEqual(getattr(orm, name).__tablename__,
+                             getattr(rows, name).__tablename__)
+
+    def testToOrm(self):
+        for name, args in ARGUMENTS:
+            instance = getattr(rows, name)(*args).toOrm()
+            self.assertIsInstance(instance, getattr(orm, name))
+            self.assertEqual(getattr(orm, name)(*args), instance)
+
+    def testEquality(self):
+        self.assertEqual(rows.Author(1, 1, 'name'), rows.Author(1, 1, 'name'))
+        self.assertNotEqual(rows.Author(1, 1, 'name'), rows.Author(1, 2, 'name'))
+        self.assertNotEqual(rows.PublicationType(1, 'a'), orm.PublicationType(1, 'a'))
+
+    def testNoInstanceDict(self):
+        self.assertFalse(hasattr(rows.Section(1, 1, 'Title', 'title'), '__dict__'))
+
+    def testParseRows(self):
+        for klass in (MedlineXMLParser, PubMedXMLParser):
+            for unique in (True, False):
+                with open(MEDLINE_STRUCTURE_FILE, 'rb') as stream:
+                    expected = list(klass(unique).parse(stream))
+
+                with open(MEDLINE_STRUCTURE_FILE, 'rb') as stream:
+                    result = list(klass(unique, rows=True).parse(stream))
+
+                self.assertEqual(len(expected), len(result))
+
+                for e, r in zip(expected, result):
+                    self.assertEqual(str(e), str(r))
+
+                    if type(e) != int:
+                        self.assertIsInstance(r, rows.Row)
+                        self.assertEqual(e, r.toOrm())
+
+
+class DigestTest(TestCase):
+
+    def citation(self):
+        return [getattr(rows, name)(*args) for name, args in ARGUMENTS]
+
+    def testStable(self):
+        self.assertEqual(rows.Digest(self.citation()), rows.Digest(self.citation()))
+        self.assertEqual(32, len(rows.Digest(self.citation())))
+
+    def testOrderIndependent(self):
+        self.assertEqual(rows.Digest(self.citation()), rows.Digest(self.citation()[::-1]))
+
+    def testIgnoresDigest(self):
+        citation = self.citation()
+        digest = rows.Digest(citation)
+        citation[-1].digest = digest
+        self.assertEqual(digest, rows.Digest(citation))
+
+    def testContentChanges(self):
+        citation = self.citation()
+        digest = rows.Digest(citation)
+        citation[0].content = 'Another Title'
+        self.assertNotEqual(digest, rows.Digest(citation))
+        self.assertNotEqual(digest, rows.Digest(self.citation()[1:]))
+
+
+if __name__ == '__main__':
+    main()
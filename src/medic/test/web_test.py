@@ -0,0 +1,511 @@
+from gzip import compress, GzipFile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import utime
+from os.path import exists, getatime, getmtime, getsize
+from socketserver import ThreadingMixIn
+from tempfile import TemporaryDirectory
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+from unittest import main, TestCase
+from unittest.mock import Mock, patch
+from urllib.error import HTTPError
+from urllib.parse import parse_qs
+from xml.etree.ElementTree import parse
+
+from medic import web
+
+__author__ = 'Florian Leitner'
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    latency = 0.0
+    requests = None
+    history = None
+    error = None
+    compress = True
+    drop = False
+    status = 200
+    sent = 0
+    articles = False
+    reorder = False
+    flaky = 0
+    failing = frozenset()
+    active = 0
+    peak = 0
+    lock = Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for eUtils: epost stores the posted PMIDs in its history (sorted
+    by PMID, if the server should *reorder* them, like eUtils) and efetch
+    responds with the requested PMIDs, one per line, after the server's
+    latency. Keeps connections alive (unless the server should *drop* them)
+    and gzips the responses if the client accepts it (and *compress* is set).
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        query = parse_qs(self.rfile.read(length).decode('ascii'))
+        self.server.requests.append((monotonic(), self.path, query, self.client_address))
+
+        if self.path.endswith('/epost.fcgi') and self.server.error:
+            self.respond('<ePostResult><ERROR>{}</ERROR></ePostResult>'.format(self.server.error))
+        elif self.path.endswith('/epost.fcgi'):
+            webenv = 'WE{}'.format(len(self.server.history))
+            ids = query['id'][0].split(',')
+            self.server.history[webenv] = sorted(ids, key=int) if self.server.reorder else ids
+            self.respond('<ePostResult><QueryKey>1</QueryKey><WebEnv>{}</WebEnv>'
+                         '</ePostResult>'.format(webenv))
+        elif 'id' in query:
+            self.fetch(query['id'][0].split(','))
+        else:
+            start, size = int(query['retstart'][0]), int(query['retmax'][0])
+            self.fetch(self.server.history[query['WebEnv'][0]][start:start + size])
+
+    def fetch(self, ids):
+        latency = self.server.latency
+
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+
+        sleep(latency(ids) if callable(latency) else latency)
+
+        with self.server.lock:
+            self.server.active -= 1
+
+        if self.server.flaky or self.server.failing.intersection(map(int, ids)):
+            self.server.flaky = max(0, self.server.flaky - 1)
+            return self.respond('Service Unavailable', 503)
+
+        if self.server.articles:
+            self.respond(ArticleSet(ids))
+        else:
+            self.respond('\n'.join(ids))
+
+    def respond(self, text, status=None):
+        body = text.encode('ascii')
+        self.send_response(status or self.server.status)
+
+        if self.server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.sent += len(body)
+        # closes the connection without telling the client:
+        self.close_connection = self.server.drop
+
+    def log_message(self, *args):
+        pass
+
+
+def ArticleSet(pmids) -> str:
+    return '<?xml version="1.0"?>\n<PubmedArticleSet>\n{}</PubmedArticleSet>\n'.format(''.join(
+        '<PubmedArticle><MedlineCitation><PMID>{}</PMID></MedlineCitation>'
+        '</PubmedArticle>\n'.format(pmid) for pmid in pmids
+    ))
+
+
+def Pmids(stream) -> list:
+    return [int(e.text) for e in parse(stream).iterfind('*/MedlineCitation/PMID')]
+
+
+class StubServerMixin:
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.history = {}
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.patch = patch.object(web, 'EUTILS_URL', url)
+        self.patch.start()
+
+    def tearDown(self):
+        web.Pool(web.EUTILS_URL).close()
+        self.patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DownloadAllTest(StubServerMixin, TestCase):
+
+    def download(self, pmids, history=False, **kwargs) -> (list, float):
+        start = monotonic()
+        result = [stream.read().decode('ascii').split('\n')
+                  for stream in web.DownloadAll(pmids, history=history, **kwargs)]
+        return result, monotonic() - start
+
+    def testChunks(self):
+        result, _ = self.download(list(range(250)), rate=1000)
+        self.assertEqual([100, 100, 50], [len(ids) for ids in result])
+        self.assertEqual([str(i) for i in range(250)], [i for ids in result for i in ids])
+
+    def testNoEmptyRequest(self):
+        result, _ = self.download(list(range(200)), rate=1000)
+        self.assertEqual(2, len(result))
+        self.assertEqual(2, len(self.server.requests))
+
+    def testInOrder(self):
+        self.server.latency = lambda ids: 0.3 if ids[0] == '0' else 0.0
+        result, _ = self.download(list(range(500)), workers=5, rate=1000)
+        self.assertEqual([str(i) for i in range(0, 500, 100)], [ids[0] for ids in result])
+
+    def testSpeedup(self):
+        self.server.latency = 0.25
+        pmids = list(range(800))
+        _, serial = self.download(pmids, workers=1, rate=1000)
+        self.assertEqual(1, self.server.peak)
+        _, concurrent = self.download(pmids, workers=8, rate=1000)
+        self.assertEqual(8, self.server.peak)
+        # serially, this takes 2 s, and concurrently about 0.25 s
+        self.assertLess(concurrent, serial / 2)
+
+    def testDefaultWorkers(self):
+        self.server.latency = 0.2
+
+        with patch.object(web, 'WORKERS', 6):
+            self.download(list(range(1200)), rate=1000)
+
+        self.assertEqual(6, self.server.peak)
+
+    def testRateLimit(self):
+        self.download(list(range(600)), workers=6, rate=10)
+        times = [r[0] for r in self.server.requests]
+        self.assertEqual(6, len(times))
+        # the 5 intervals take 0.5 s, but each request might arrive late
+        self.assertGreaterEqual(times[-1] - times[0], 0.4)
+
+    def testApiKey(self):
+        with patch.object(web, 'API_KEY', 'secret'):
+            self.download([1])
+
+        self.assertEqual(['secret'], self.server.requests[0][2]['api_key'])
+
+    def testDefaultRate(self):
+        self.download(list(range(300)))
+        times = [r[0] for r in self.server.requests]
+        self.assertGreaterEqual(times[-1] - times[0], 1.5 / web.REQUESTS_PER_SECOND)
+
+    def testHistory(self):
+        pmids = list(range(2500))
+        result, _ = self.download(pmids, history=True, rate=1000)
+        self.assertEqual([1000, 1000, 500], [len(ids) for ids in result])
+        self.assertEqual([str(i) for i in pmids], [i for ids in result for i in ids])
+        paths = [r[1] for r in self.server.requests]
+        self.assertEqual(['/epost.fcgi'] + ['/efetch.fcgi'] * 3, paths)
+
+    def testHistoryByDefault(self):
+        self.download(list(range(101)), history=None, rate=1000)
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual('/epost.fcgi', self.server.requests[0][1])
+        self.download(list(range(100)), history=None, rate=1000)
+        self.assertEqual('/efetch.fcgi', self.server.requests[2][1])
+        self.assertEqual(3, len(self.server.requests))
+
+    def testPostsIds(self):
+        self.download([1, 2, 3], rate=1000)
+        _, path, query, _ = self.server.requests[0]
+        self.assertEqual('/efetch.fcgi', path)
+        self.assertEqual(['1,2,3'], query['id'])
+        self.assertEqual(['pubmed'], query['db'])
+
+    def testEPostError(self):
+        self.server.error = 'Invalid uid'
+
+        with self.assertRaisesRegex(web.EUtilsError, 'Invalid uid'):
+            web.EPost([1, 2])
+
+        self.assertFalse(web.Transient(web.EUtilsError('Invalid uid')))
+
+    def testKeepAlive(self):
+        result, _ = self.download(list(range(500)), workers=1, rate=1000)
+        self.assertEqual(5, len(result))
+        self.assertEqual(1, len({r[3] for r in self.server.requests}))
+        self.assertEqual(1, web.Pool(web.EUTILS_URL).connections)
+
+    def testReconnect(self):
+        self.server.drop = True
+        result, _ = self.download(list(range(300)), workers=1, rate=1000)
+        self.assertEqual(3, len(result))
+        self.assertEqual(3, len({r[3] for r in self.server.requests}))
+
+    def testGzip(self):
+        pmids = list(range(1000, 2000))
+        compressed, _ = self.download(pmids, rate=1000)
+        sent = self.server.sent
+        self.server.compress = False
+        self.server.sent = 0
+        plain, _ = self.download(pmids, rate=1000)
+        self.assertEqual(plain, compressed)
+        self.assertLess(sent, self.server.sent / 2)
+
+    def testStreamingDecompression(self):
+        response = web.Download([1, 2])
+        self.assertTrue(response.gzipped)
+        stream = response.buffer()
+        self.assertIsInstance(stream, GzipFile)
+        self.assertEqual(b'1\n2', stream.read())
+
+    def testHTTPError(self):
+        self.server.status = 500
+
+        with self.assertRaises(HTTPError) as cm:
+            web.Download([1])
+
+        self.assertEqual(500, cm.exception.code)
+
+
+class RetryTest(StubServerMixin, TestCase):
+
+    def setUp(self):
+        super(RetryTest, self).setUp()
+        self.backoff = patch.object(web, 'BACKOFF', 0.01)
+        self.backoff.start()
+
+    def tearDown(self):
+        self.backoff.stop()
+        super(RetryTest, self).tearDown()
+
+    def download(self, pmids, **kwargs) -> list:
+        streams = web.DownloadAll(pmids, rate=1000, **kwargs)
+        return [int(i) for stream in streams for i in stream.read().decode('ascii').split('\n')]
+
+    def testRetry(self):
+        self.server.flaky = 2
+
+        with self.assertLogs('medic.web', 'WARNING'):
+            self.assertEqual([1, 2], self.download([1, 2]))
+        self.assertEqual(3, len(self.server.requests))
+
+    def testGiveUp(self):
+        self.server.flaky = 5
+
+        with self.assertRaises(HTTPError), self.assertLogs('medic.web', 'WARNING'):
+            self.download([1, 2])
+
+        self.assertEqual(web.RETRIES + 1, len(self.server.requests))
+
+    def testNoRetryOnClientError(self):
+        self.server.status = 400
+
+        with self.assertRaises(HTTPError):
+            self.download([1])
+
+        self.assertEqual(1, len(self.server.requests))
+
+    def testBackoff(self):
+        attempts = []
+
+        def request():
+            attempts.append(monotonic())
+            raise ConnectionResetError()
+
+        with self.assertRaises(ConnectionResetError), self.assertLogs('medic.web', 'WARNING'):
+            web.Retry(request, retries=2, backoff=0.1)
+
+        self.assertEqual(3, len(attempts))
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.05)
+        self.assertGreaterEqual(attempts[2] - attempts[1], 0.1)
+
+    def testSplit(self):
+        self.server.failing = {42, 77}
+        failed = []
+        pmids = list(range(100))
+
+        with self.assertLogs('medic.web', 'ERROR') as log:
+            self.assertEqual([p for p in pmids if p not in (42, 77)],
+                             self.download(pmids, failed=failed, history=False))
+
+        self.assertEqual([42, 77], failed)
+        self.assertEqual(2, len([line for line in log.output if line.startswith('ERROR')]))
+
+    def articles(self, pmids, **kwargs) -> list:
+        self.server.articles = True
+        streams = web.DownloadAll(pmids, rate=1000, **kwargs)
+        return [pmid for stream in streams for pmid in Pmids(stream)]
+
+    def testSplitHistoryPage(self):
+        self.server.failing = {1500}
+        failed = []
+        pmids = list(range(2500))
+
+        with self.assertLogs('medic.web', 'ERROR'):
+            result = self.articles(pmids, failed=failed, history=True)
+
+        # the PMIDs of the failed page are fetched last
+        self.assertEqual([p for p in pmids if p != 1500], sorted(result))
+        self.assertEqual(list(range(2000, 2500)), result[1000:1500])
+
+        self.assertEqual([1500], failed)
+
+    def testSplitReorderedHistoryPage(self):
+        # eUtils returns the history sorted, not in the posted order
+        self.server.reorder = True
+        self.server.failing = {1500}
+        failed = []
+        pmids = list(range(2499, -1, -1))
+
+        with self.assertLogs('medic.web', 'ERROR'):
+            result = self.articles(pmids, failed=failed, history=True)
+
+        self.assertEqual(sorted(p for p in pmids if p != 1500), sorted(result))
+        self.assertEqual(len(set(result)), len(result))
+        self.assertEqual([1500], failed)
+
+    def testNoHistoryRecovery(self):
+        self.server.reorder = True
+        pmids = list(range(2499, -1, -1))
+        self.assertEqual(sorted(pmids), self.articles(pmids, failed=[], history=True))
+        self.assertEqual(4, len(self.server.requests))
+
+    def testEPostFallback(self):
+        self.server.error = 'Unavailable'
+        failed = []
+
+        with self.assertLogs('medic.web', 'WARNING'):
+            self.assertEqual(list(range(250)), self.download(list(range(250)), failed=failed))
+
+        self.assertEqual([], failed)
+        # the EPost error is not retried
+        self.assertEqual(1 + 3, len(self.server.requests))
+
+
+class CacheTest(StubServerMixin, TestCase):
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.server.articles = True
+        self.tmp = TemporaryDirectory()
+        self.cache = web.Cache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super(CacheTest, self).tearDown()
+
+    def download(self, pmids, cache=None):
+        streams = web.CachedDownloadAll(pmids, cache or self.cache, history=False, rate=1000)
+        return [pmid for stream in streams for pmid in Pmids(stream)]
+
+    def requested(self) -> list:
+        return sorted(int(i) for r in self.server.requests for i in r[2]['id'][0].split(','))
+
+    def testMisses(self):
+        self.assertEqual(list(range(250)), self.download(list(range(250))))
+        self.assertEqual(list(range(250)), self.requested())
+        self.assertEqual((0, 250), (self.cache.hits, self.cache.misses))
+
+    def testHits(self):
+        self.download(list(range(250)))
+        self.server.requests = []
+        self.assertEqual(list(range(300)), sorted(self.download(list(range(300)))))
+        self.assertEqual(list(range(250, 300)), self.requested())
+        self.assertEqual((250, 300), (self.cache.hits, self.cache.misses))
+
+    def testAllCached(self):
+        self.download([1, 2])
+        self.server.requests = []
+        self.assertEqual([1, 2], self.download([1, 2]))
+        self.assertEqual([], self.server.requests)
+
+    def testRecord(self):
+        self.download([123])
+        self.assertEqual(b'<PubmedArticle><MedlineCitation><PMID>123</PMID>'
+                         b'</MedlineCitation></PubmedArticle>', self.cache.get(123))
+
+    def testTTL(self):
+        self.download([1, 2])
+        expired = web.Cache(self.tmp.name, ttl=-1)
+        self.server.requests = []
+        self.assertEqual([1, 2], self.download([1, 2], expired))
+        self.assertEqual([1, 2], self.requested())
+
+    def testEvictLeastRecentlyUsed(self):
+        self.download([1, 2, 3])
+        size = getsize(self.cache.path(1))
+        now = time()
+
+        for pmid, age in ((1, 10), (2, 30), (3, 20)):
+            utime(self.cache.path(pmid), (now - age, now))
+
+        self.cache.max_bytes = 2 * size
+        self.cache.evict()
+        self.assertEqual([True, False, True],
+                         [exists(self.cache.path(pmid)) for pmid in (1, 2, 3)])
+
+    def testEvictAfterFailure(self):
+        self.server.status = 400
+        streams = web.CachedDownloadAll([1], self.cache, history=False, rate=1000)
+
+        with patch.object(self.cache, 'evict') as evict:
+            with self.assertRaises(HTTPError):
+                list(streams)
+
+        evict.assert_called_once_with()
+
+    def testEvictAfterClose(self):
+        streams = web.CachedDownloadAll(list(range(250)), self.cache, history=False, rate=1000)
+
+        with patch.object(self.cache, 'evict') as evict:
+            next(streams)
+            streams.close()
+
+        evict.assert_called_once_with()
+
+    def testGetMarksUsed(self):
+        self.download([1])
+        path = self.cache.path(1)
+        utime(path, (0, getmtime(path)))
+        self.cache.get(1)
+        self.assertGreater(getatime(path), 0)
+
+
+class ConnectionPoolTest(TestCase):
+
+    def testFailedReconnectCloses(self):
+        pool = web.ConnectionPool('http://localhost/')
+        stale = Mock()
+        stale.request.side_effect = ConnectionResetError()
+        pool.idle.append(stale)
+        fresh = Mock()
+        fresh.getresponse.side_effect = ConnectionRefusedError()
+        pool.klass = Mock(return_value=fresh)
+
+        with self.assertRaises(ConnectionRefusedError):
+            pool.request('/efetch.fcgi', b'id=1')
+
+        stale.close.assert_called_once_with()
+        fresh.close.assert_called_once_with()
+        self.assertEqual([], pool.idle)
+
+
+class TokenBucketTest(TestCase):
+
+    def testBurst(self):
+        bucket = web.TokenBucket(1, capacity=3)
+
+        with patch.object(web, 'sleep') as wait:
+            for _ in range(3):
+                bucket.acquire()
+
+        wait.assert_not_called()
+
+    def testRate(self):
+        bucket = web.TokenBucket(20)
+        start = monotonic()
+
+        for _ in range(5):
+            bucket.acquire()
+
+        self.assertGreaterEqual(monotonic() - start, 0.19)
+
+
+if __name__ == '__main__':
+    main()
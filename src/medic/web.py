@@ -7,37 +7,679 @@
 """
 
 import logging
-from http.client import HTTPResponse  # function annotation only
-from urllib.request import build_opener
+import re
 
-URL_OPENER = build_opener()
-# to avoid having to build a new opener for each request
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from gzip import GzipFile, open as gunzip
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, HTTPResponse
+from io import BytesIO
+from os import makedirs, remove, replace, scandir, stat, utime
+from os.path import dirname, isdir, join
+from random import uniform
+from threading import get_ident, Lock
+from time import monotonic, sleep, time
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlsplit
+from xml.etree.ElementTree import fromstring, iterparse, tostring
 
 logger = logging.getLogger(__name__)
 
-EUTILS_URL = 'http://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?' \
-             'tool=libfnl&db=pubmed&retmode=xml&rettype=medline&id='
+EUTILS_URL = 'http://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
 """
-The eUtils URL to which requests for MEDLINE XML records can be made.
-Multiple PMIDs may be appended comma-separated to this URL.
+The base URL of NCBI's eUtils; Requests are made to ``efetch.fcgi`` and
+``epost.fcgi`` relative to it.
 """
 
+EFETCH_PARAMS = (('tool', 'libfnl'), ('db', 'pubmed'), ('retmode', 'xml'), ('rettype', 'medline'))
+"""The query parameters of all efetch requests for MEDLINE XML records."""
 
-def Download(pmids: list, timeout: int=60) -> HTTPResponse:
+FETCH_SIZE = 100
+"""The maximum number of PMIDs to fetch with one id-list request."""
+
+HISTORY_FETCH_SIZE = 1000
+"""The number of records to fetch with one request from the eUtils history."""
+
+REQUESTS_PER_SECOND = 3
+"""NCBI's limit of eUtils requests per second (without an API key)."""
+
+API_KEY_REQUESTS_PER_SECOND = 10
+"""NCBI's limit of eUtils requests per second with an API key."""
+
+API_KEY = None
+"""The NCBI API key to send with all requests (if any)."""
+
+WORKERS = 4
+"""The default number of concurrent downloads."""
+
+RETRIES = 3
+"""The number of times a request that failed with a `Transient` error is retried."""
+
+BACKOFF = 1.0
+"""The delay (in seconds) before the first retry; it doubles with each retry."""
+
+POOL_SIZE = 10
+"""The maximum number of idle connections kept open per host."""
+
+
+class EUtilsError(IOError):
+    """
+    An error that eUtils reports in the body of a successful (200 OK)
+    response; Unlike network or server errors, it is not `Transient`.
+    """
+
+
+class Response:
+    """
+    A response stream from a `ConnectionPool`, decompressed on the fly if the
+    body was gzip-encoded.
+
+    Closing the response returns its connection to the pool if the body was
+    read completely; Otherwise, the connection is closed.
+    """
+
+    def __init__(self, pool, connection: HTTPConnection, response: HTTPResponse):
+        self.pool = pool
+        self.connection = connection
+        self.response = response
+        self.gzipped = response.getheader('Content-Encoding', '').lower() == 'gzip'
+        self.stream = GzipFile(fileobj=response, mode='rb') if self.gzipped else response
+
+    @property
+    def status(self) -> int:
+        return self.response.status
+
+    def read(self, size: int=-1) -> bytes:
+        return self.stream.read(size)
+
+    def buffer(self) -> BytesIO:
+        """
+        Read the whole (compressed) body, close the response, and return a
+        stream over the body that decompresses as it is read.
+        """
+        try:
+            body = BytesIO(self.response.read())
+        finally:
+            self.close()
+
+        return GzipFile(fileobj=body, mode='rb') if self.gzipped else body
+
+    def close(self):
+        if self.connection is not None:
+            if self.response.isclosed():
+                self.pool.release(self.connection)
+            else:
+                self.response.close()
+                self.connection.close()
+
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of persistent HTTP/1.1 connections to the host of
+    *url* that asks for gzip-compressed responses.
+
+    Up to *size* idle connections are kept open for reuse; If a reused
+    connection was closed by the server in the meantime, the request is
+    retried once on a new connection.
+    """
+
+    def __init__(self, url: str, size: int=POOL_SIZE):
+        parts = urlsplit(url)
+        self.klass = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        self.host = parts.netloc
+        self.size = size
+        self.idle = []
+        self.lock = Lock()
+        self.connections = 0
+        "The number of connections opened so far."
+
+    def request(self, path: str, data: bytes, timeout: int=60) -> Response:
+        """
+        POST the *data* to the *path* on this host.
+
+        :return: the `Response`
+
+        :raises urllib.error.HTTPError: if the response status is not 200 OK
+        """
+        headers = {
+            'Accept-Encoding': 'gzip',
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+        connection, reused = self._acquire(timeout)
+
+        try:
+            connection.request('POST', path, data, headers)
+            response = connection.getresponse()
+        except (HTTPException, ConnectionError):
+            connection.close()
+
+            if not reused:
+                raise
+
+            logger.debug('reused connection to %s was closed; reconnecting', self.host)
+            connection = self._connect(timeout)
+
+            try:
+                connection.request('POST', path, data, headers)
+                response = connection.getresponse()
+            except BaseException:
+                connection.close()
+                raise
+
+        result = Response(self, connection, response)
+
+        if response.status != 200:
+            message = result.read()
+            result.close()
+            raise HTTPError(self.host + path, response.status, response.reason,
+                            response.msg, BytesIO(message))
+
+        return result
+
+    def release(self, connection: HTTPConnection):
+        "Return a *connection* to the pool (or close it, if the pool is full)."
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        "Close all idle connections."
+        with self.lock:
+            idle, self.idle = self.idle, []
+
+        for connection in idle:
+            connection.close()
+
+    def _acquire(self, timeout: int) -> (HTTPConnection, bool):
+        with self.lock:
+            connection = self.idle.pop() if self.idle else None
+
+        if connection is None:
+            return self._connect(timeout), False
+
+        connection.timeout = timeout
+
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+
+        return connection, True
+
+    def _connect(self, timeout: int) -> HTTPConnection:
+        with self.lock:
+            self.connections += 1
+
+        return self.klass(self.host, timeout=timeout)
+
+
+_POOLS = {}
+_POOLS_LOCK = Lock()
+
+
+def Pool(url: str) -> ConnectionPool:
+    "Return the (shared) `ConnectionPool` for the host of *url*."
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = ConnectionPool(url)
+
+        return _POOLS[key]
+
+
+def _post(utility: str, params: list, timeout: int) -> Response:
+    "POST the *params* (and the `API_KEY`, if set) to an eUtils *utility*."
+    if API_KEY:
+        params = list(params) + [('api_key', API_KEY)]
+
+    data = urlencode(params).encode('ascii')
+    url = EUTILS_URL + utility
+    return Pool(url).request(urlsplit(url).path, data, timeout)
+
+
+def Download(pmids: list, timeout: int=60) -> Response:
     """
     :param pmids: a list of PMIDs, but no more than `FETCH_SIZE`; values that
         can be cast to string
     :param timeout: seconds to wait for a response
 
-    :return: an open XML stream
+    :return: an open (decompressed) XML stream
 
     :raises IOError: if the stream from eUtils cannot be opened
-    :raises urllib.error.URLError: if the connection to the eUtils URL cannot
-        be made
+    :raises urllib.error.HTTPError: if eUtils does not respond with 200 OK
     :raises socket.timout: if *timeout* seconds have passed before a response
         arrives
     """
-    assert len(pmids) <= 100, 'too many PMIDs'
-    url = EUTILS_URL + ','.join(map(str, pmids))
-    logger.info('fetching %i MEDLINE records from %s', len(pmids), url)
-    return URL_OPENER.open(url, timeout=timeout)
+    assert len(pmids) <= FETCH_SIZE, 'too many PMIDs'
+    logger.info('fetching %i MEDLINE records', len(pmids))
+    return _post('efetch.fcgi', EFETCH_PARAMS + (('id', ','.join(map(str, pmids))),), timeout)
+
+
+def EPost(pmids: list, timeout: int=60) -> (str, str):
+    """
+    Upload any number of *pmids* to the eUtils history server.
+
+    :return: the ``WebEnv`` and ``query_key`` to fetch the records with
+        (see `DownloadHistory`)
+
+    :raises EUtilsError: if eUtils reports an error or the response is invalid
+    """
+    logger.info('posting %i PMIDs to the eUtils history', len(pmids))
+    params = (('db', 'pubmed'), ('id', ','.join(map(str, pmids))))
+    with _post('epost.fcgi', params, timeout) as response:
+        result = fromstring(response.read())
+
+    webenv, query_key = result.findtext('WebEnv'), result.findtext('QueryKey')
+
+    if not webenv or not query_key:
+        raise EUtilsError('EPost failed: {}'.format(result.findtext('.//ERROR') or 'no WebEnv'))
+
+    return webenv, query_key
+
+
+def DownloadHistory(webenv: str, query_key: str, start: int, size: int=HISTORY_FETCH_SIZE,
+                    timeout: int=60) -> Response:
+    """
+    Fetch *size* MEDLINE XML records, starting at offset *start*, from a PMID
+    set in the eUtils history (see `EPost`).
+
+    :return: an open (decompressed) XML stream
+    """
+    logger.info('fetching MEDLINE records %i-%i from the eUtils history', start, start + size)
+    params = EFETCH_PARAMS + (('WebEnv', webenv), ('query_key', query_key),
+                              ('retstart', str(start)), ('retmax', str(size)))
+    return _post('efetch.fcgi', params, timeout)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket limiter: `acquire` blocks until one of the
+    *capacity* tokens is available, and tokens are refilled at *rate* tokens
+    per second.
+    """
+
+    def __init__(self, rate: float, capacity: int=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        "Take a token, waiting for it if necessary."
+        with self.lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                sleep((1 - self.tokens) / self.rate)
+
+
+def Transient(error: Exception) -> bool:
+    "Return ``True`` if a request that failed with *error* is worth retrying."
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code == 429
+    elif isinstance(error, EUtilsError):
+        return False
+
+    return isinstance(error, (OSError, HTTPException))
+
+
+def Retry(request, limiter: TokenBucket=None, retries: int=None, backoff: float=None):
+    """
+    Call *request* (after acquiring a token from the *limiter*, if any), and
+    retry it up to *retries* times (default: `RETRIES`) if it fails with a
+    `Transient` error.
+
+    Before each retry, the delay grows exponentially from *backoff* seconds
+    (default: `BACKOFF`), with a random jitter of +/-50%.
+
+    :return: the result of the *request*
+    :raises: the last error, if all attempts failed
+    """
+    retries = RETRIES if retries is None else retries
+    backoff = BACKOFF if backoff is None else backoff
+
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            return request()
+        except Exception as error:
+            if attempt == retries or not Transient(error):
+                raise
+
+            delay = backoff * 2 ** attempt * uniform(0.5, 1.5)
+            logger.warning('request failed (%s); retrying in %.1f s', error, delay)
+            sleep(delay)
+
+
+def DownloadAll(pmids: list, workers: int=None, rate: float=None, timeout: int=60,
+                history: bool=None, failed: list=None) -> iter([BytesIO]):
+    """
+    Download the MEDLINE XML for any number of *pmids*, using *workers*
+    concurrent requests (default: `WORKERS`).
+
+    With *history*, the *pmids* are uploaded once with `EPost` and then
+    fetched in pages of `HISTORY_FETCH_SIZE` records from the eUtils history;
+    Otherwise, they are fetched in id-list requests of `FETCH_SIZE` PMIDs. By
+    default, the history is used if there are more than `FETCH_SIZE` *pmids*.
+
+    The requests are limited to *rate* per second (by default, NCBI's limit:
+    `API_KEY_REQUESTS_PER_SECOND` if an `API_KEY` is set, otherwise
+    `REQUESTS_PER_SECOND`). The downloaded XML streams are yielded in the
+    order of the requests, as soon as each is available; At most twice as many
+    requests as *workers* are scheduled ahead of the consumer. Compressed
+    responses are buffered as such and only decompressed as they are read.
+
+    All requests are retried (see `Retry`). If a *failed* list is given, an
+    id-list request that still fails is split into halves until the failing
+    PMIDs are isolated and appended to *failed*; If the `EPost` fails, the
+    *pmids* are fetched with id-list requests. The history does not return
+    the records in the order they were posted, so only the PMIDs of the
+    received records tell what a history page held: If a page fails, all
+    *pmids* that were not received from the history are fetched by id once
+    the other pages are done.
+
+    :raises: any error `Download`, `EPost`, or `DownloadHistory` raise, when
+        the failed stream is due and no *failed* list is given
+    """
+    workers = WORKERS if workers is None else workers
+
+    if rate is None:
+        rate = API_KEY_REQUESTS_PER_SECOND if API_KEY else REQUESTS_PER_SECOND
+
+    if history is None:
+        history = len(pmids) > FETCH_SIZE
+
+    limiter = TokenBucket(rate)
+    requests = None
+
+    if history and pmids:
+        try:
+            webenv, query_key = Retry(partial(EPost, pmids, timeout), limiter)
+            # history pages are not paired with any PMIDs (see above)
+            requests = ((None, partial(DownloadHistory, webenv, query_key, start,
+                                       HISTORY_FETCH_SIZE))
+                        for start in range(0, len(pmids), HISTORY_FETCH_SIZE))
+        except (OSError, HTTPException) as error:
+            if failed is None:
+                raise
+
+            logger.warning('posting the PMIDs failed (%s); fetching them by id', error)
+
+    if requests is None:
+        requests = ((pmids[i:i + FETCH_SIZE], partial(Download, pmids[i:i + FETCH_SIZE]))
+                    for i in range(0, len(pmids), FETCH_SIZE))
+
+    received = set()
+    lost = []
+
+    def fetch(request) -> BytesIO:
+        return Retry(lambda: request(timeout=timeout).buffer(), limiter)
+
+    def byId(batch: list) -> iter([BytesIO]):
+        "Download a *batch* of PMIDs in id-list requests, isolating the failing PMIDs."
+        for i in range(0, len(batch), FETCH_SIZE):
+            part = batch[i:i + FETCH_SIZE]
+
+            try:
+                yield fetch(partial(Download, part))
+            except (OSError, HTTPException) as error:
+                logger.warning('downloading %i PMIDs failed (%s); splitting them', len(part), error)
+                yield from recover(part)
+
+    def recover(batch: list) -> iter([BytesIO]):
+        "Download a failed *batch* of PMIDs in halves, isolating the failing PMIDs."
+        if len(batch) == 1:
+            logger.error('downloading PMID %s failed', batch[0])
+            failed.append(batch[0])
+            return
+
+        half = (len(batch) + 1) // 2
+
+        for part in (batch[:half], batch[half:]):
+            if len(part) > FETCH_SIZE:
+                yield from recover(part)
+                continue
+
+            try:
+                yield fetch(partial(Download, part))
+            except (OSError, HTTPException) as error:
+                logger.warning('downloading %i PMIDs failed (%s); splitting them', len(part), error)
+                yield from recover(part)
+
+    def due(batch: list, future) -> iter([BytesIO]):
+        try:
+            stream = future.result()
+        except (OSError, HTTPException) as error:
+            if failed is None:
+                raise
+            elif batch is None:
+                logger.warning('downloading a history page failed (%s); '
+                               'fetching the PMIDs not received by id', error)
+                lost.append(error)
+                return ()
+
+            logger.warning('downloading %i PMIDs failed (%s); splitting them', len(batch), error)
+            return recover(batch)
+
+        if batch is None and failed is not None:
+            xml = stream.read()
+            received.update(_receivedPmids(xml))
+            stream = BytesIO(xml)
+
+        return (stream,)
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+
+        for batch, request in requests:
+            pending.append((batch, executor.submit(fetch, request)))
+
+            if len(pending) >= 2 * workers:
+                yield from due(*pending.popleft())
+
+        while pending:
+            yield from due(*pending.popleft())
+
+    if lost:
+        missing = [p for p in OrderedDict.fromkeys(pmids) if int(p) not in received]
+        logger.info('fetching %i PMIDs of %i failed history pages by id', len(missing), len(lost))
+        yield from byId(missing)
+
+
+PMID_PATTERN = re.compile(rb'<(?:MedlineCitation|BookDocument)[^>]*>\s*<PMID[^>]*>\s*(\d+)')
+"""The PMID of each record in a PubMed XML response."""
+
+
+def _receivedPmids(xml: bytes) -> iter([int]):
+    "Return the PMIDs of the records in a PubMed *xml* response."
+    return (int(pmid) for pmid in PMID_PATTERN.findall(xml))
+
+
+CACHE = None
+"""The `Cache` of downloaded records to use (if any; see `CachedDownloadAll`)."""
+
+
+class Cache:
+    """
+    An on-disk cache of downloaded PubMed XML records in *directory*, with
+    one gzipped ``PubmedArticle`` per PMID.
+
+    Records older than *ttl* seconds are misses; `evict` removes the least
+    recently used records until the cache holds no more than *max_bytes*.
+    `hits` and `misses` count the PMIDs looked up.
+    """
+
+    RECORDS = frozenset({'PubmedArticle', 'PubmedBookArticle'})
+
+    def __init__(self, directory: str, ttl: float=7 * 24 * 3600, max_bytes: int=2 ** 30):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, pmid: int) -> str:
+        "Return the path of the cached record for *pmid*."
+        return join(self.directory, '{:03d}'.format(int(pmid) % 1000), '{}.xml.gz'.format(pmid))
+
+    def get(self, pmid: int) -> bytes:
+        "Return the cached XML record for *pmid* or ``None`` (a miss)."
+        path = self.path(pmid)
+
+        try:
+            modified = stat(path).st_mtime
+            now = time()
+
+            if now - modified <= self.ttl:
+                with gunzip(path) as stream:
+                    record = stream.read()
+
+                # the access time marks the record as recently used
+                utime(path, (now, modified))
+                self.hits += 1
+                return record
+        except OSError:
+            pass
+
+        self.misses += 1
+        return None
+
+    def put(self, pmid: int, record: bytes):
+        "Store the XML *record* for *pmid*."
+        path = self.path(pmid)
+        makedirs(dirname(path), exist_ok=True)
+        partial_path = '{}.{}.tmp'.format(path, get_ident())
+
+        with GzipFile(partial_path, 'wb') as stream:
+            stream.write(record)
+
+        replace(partial_path, path)
+
+    def store(self, xml: bytes):
+        "Store all records in a PubMed *xml* response."
+        depth = 0
+
+        for event, element in iterparse(BytesIO(xml), ('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+
+            depth -= 1
+
+            if depth == 1 and element.tag in Cache.RECORDS:
+                pmid = element.findtext('*/PMID')
+
+                if pmid:
+                    element.tail = None
+                    self.put(int(pmid), tostring(element, encoding='utf-8'))
+
+                element.clear()
+
+    def evict(self):
+        "Remove the least recently used records while the cache exceeds *max_bytes*."
+        if not isdir(self.directory):
+            return
+
+        records = []
+
+        for shard in scandir(self.directory):
+            if shard.is_dir():
+                for entry in scandir(shard.path):
+                    try:
+                        info = entry.stat()
+                    except FileNotFoundError:
+                        continue  # evicted by another process
+
+                    records.append((info.st_atime, info.st_size, entry.path))
+
+        size = sum(r[1] for r in records)
+
+        if size > self.max_bytes:
+            records.sort()
+
+            for _, length, path in records:
+                try:
+                    remove(path)
+                except FileNotFoundError:
+                    pass
+
+                size -= length
+
+                if size <= self.max_bytes:
+                    break
+
+            logger.info('evicted cached records down to %i bytes', size)
+
+
+def CachedDownloadAll(pmids: list, cache: Cache=None, **kwargs) -> iter([BytesIO]):
+    """
+    Like `DownloadAll`, but only download the *pmids* that are not in the
+    *cache* (by default, the `CACHE`, if set) and store the downloaded
+    records in it.
+
+    The cached records are yielded first (as PubMed XML streams of up to
+    `HISTORY_FETCH_SIZE` records), followed by the downloaded streams; The
+    cache is evicted once the download is done, failed, or was abandoned.
+    """
+    if cache is None:
+        cache = CACHE
+
+    if cache is None:
+        yield from DownloadAll(pmids, **kwargs)
+        return
+
+    missing = []
+    records = []
+
+    for pmid in pmids:
+        record = cache.get(pmid)
+
+        if record is None:
+            missing.append(pmid)
+        else:
+            records.append(record)
+
+            if len(records) == HISTORY_FETCH_SIZE:
+                yield _articleSet(records)
+                records = []
+
+    if records:
+        yield _articleSet(records)
+
+    logger.info('%i cached records, downloading %i', len(pmids) - len(missing), len(missing))
+
+    try:
+        for stream in DownloadAll(missing, **kwargs):
+            xml = stream.read()
+            cache.store(xml)
+            yield BytesIO(xml)
+    finally:
+        cache.evict()
+
+
+def _articleSet(records: list) -> BytesIO:
+    return BytesIO(b''.join([
+        b'<?xml version="1.0" encoding="utf-8"?>\n<PubmedArticleSet>\n',
+        b'\n'.join(records), b'\n</PubmedArticleSet>\n'
+    ]))